@@ -1,47 +1,198 @@
-from typing import Dict, Any, List
-import json
-import aiohttp
-import os
-from .base_agent import BaseAgent
+from typing import Dict, Any
+import asyncio
+from .base_agent import BaseAgent, LLM_MAX_CONC
+from schemas.responses import ArchitectureResponse, DesignResponse, ArchitectureRecommendation, SystemDesignResponse
+from utils.generative_cache import TemplateId
+
+# Static system prompts come first and variable user prompts last, so repeated calls
+# share a prefix the provider can cache. User prompt templates are filled in with str.format.
+_ANALYZE_REQUIREMENTS_SYSTEM = """
+You are an expert software architect. Please analyze the requirements for the project given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to that project.
+
+Provide a comprehensive list of functional and non-functional requirements for this project.
+Also include a high-level architecture with key components.
+
+Format your response as JSON with the following structure:
+{
+    "requirements": [
+        "Detailed requirement 1 specific to the project",
+        "Detailed requirement 2 specific to the project",
+        "..."
+    ],
+    "architecture": {
+        "components": [
+            {"name": "Component name specific to the project", "description": "Detailed description of this component's purpose and functionality"},
+            {...}
+        ],
+        "data_flow": "Detailed description of how data flows between components"
+    }
+}
+"""
+
+_DESIGN_SOLUTION_SYSTEM = """
+You are an expert software architect. Please design a solution for the project given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to that project.
+
+Provide a detailed design including UI mockup description, components, and data model.
+
+Format your response as JSON with the following structure:
+{
+    "design": {
+        "ui_mockup": "Detailed description of the user interface for the project",
+        "components": [
+            {"name": "Component name specific to the project", "purpose": "Detailed description of this component's purpose"},
+            {...}
+        ],
+        "data_model": {
+            "Entity1": "data type and description",
+            "Entity2": "data type and description",
+            "...": "..."
+        }
+    }
+}
+"""
+
+_PROJECT_USER_TPL = """
+Project: {project_title}
+Description: {project_description}
+"""
+
+_EXECUTE_STEP_SYSTEM = """
+You are an expert software architect. Please complete the step in a software development plan given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to the user's project.
+
+Provide a detailed response appropriate for this step in the development process.
+
+Format your response as JSON with appropriate fields for this step.
+"""
+
+_EXECUTE_STEP_USER_TPL = """
+Step: {step_title}
+Description: {step_description}
+
+Context:
+Project: {project_title}
+Description: {project_description}
+"""
+
+_EXECUTE_STEP_RETRY_TPL = """
+Generate a detailed response for this software development step:
+Project: {project_title}
+Description: {project_description}
+Step: {step_title}
+
+For this specific project, include relevant features and components.
+
+Your response must be in JSON format and specifically tailored to {project_title}.
+If this is a requirements analysis step, include "requirements" and "architecture" fields.
+If this is a design step, include a "design" field with "ui_mockup", "components", and "data_model".
+"""
+
+_EXECUTE_STEP_FINAL_TPL = """
+Create a JSON response for {project_title} with appropriate fields based on the step: {step_title}.
+Make sure your response is specifically about {project_description}.
+"""
+
+_ARCHITECTURE_QUESTION_SYSTEM = """
+You are an expert software architect. Please provide a detailed architecture recommendation for the user's question.
+
+Your response should include:
+1. Overall architecture style recommendation
+2. Key components and their responsibilities
+3. Recommended patterns and practices
+4. Suitable technologies
+5. Considerations for scalability, security, and maintainability
+
+Format your response as JSON with the following structure:
+{
+    "architecture_type": "string",
+    "components": [
+        {"name": "string", "purpose": "string"}
+    ],
+    "patterns": ["string"],
+    "technologies": ["string"],
+    "considerations": ["string"]
+}
+"""
+
+_ARCHITECTURE_QUESTION_USER_TPL = """
+Question: {question}
+"""
+
+_ARCHITECTURE_QUESTION_RETRY_TPL = """
+Provide an architecture recommendation for: {question}
+Format as JSON with architecture_type, components, patterns, technologies, and considerations fields.
+"""
+
+_DESIGN_SYSTEM_SYSTEM = """
+You are an expert software architect. Please design the system described by the user.
+
+Your design should include:
+1. Overall architecture style
+2. Key components and their responsibilities
+3. Technology stack recommendations
+4. Deployment strategy
+
+Format your response as JSON with the following structure:
+{
+    "system_name": "the system name given by the user",
+    "architecture_style": "string",
+    "components": [
+        {"name": "string", "technology": "string", "responsibility": "string"}
+    ],
+    "deployment": {
+        "strategy": "string",
+        "platform": "string",
+        "ci_cd": "string"
+    }
+}
+
+Ensure that your design is specifically tailored to that system and addresses the provided requirements.
+"""
+
+_DESIGN_SYSTEM_USER_TPL = """
+System Name: {system_name}
+Requirements: {requirements}
+"""
+
+_DESIGN_SYSTEM_RETRY_TPL = """
+Design a system for {system_name} that addresses these requirements: {requirements}
+Format as JSON with system_name, architecture_style, components, and deployment fields.
+"""
 
 class ArchitectAgent(BaseAgent):
     """Agent responsible for system architecture and design decisions."""
     
     def __init__(self, agent_id: str = None, name: str = "ArchitectAgent"):
         super().__init__(agent_id, name)
+        self._handlers = {
+            "architecture_question": self._handle_architecture_question,
+            "execute_step": self._handle_execute_step,
+            "execute_steps_batch": self._handle_execute_steps_batch,
+            "design_system": self._handle_design_system
+        }
     
     async def process_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """Process a message sent to this agent."""
-        content = message.get("content", {})
-        message_type = content.get("type", "")
-        
-        if message_type == "architecture_question":
-            return await self._handle_architecture_question(content)
-        elif message_type == "execute_step":
-            return await self._handle_execute_step(content)
-        else:
-            return {
-                "status": "error",
-                "message": f"Unsupported task type: {message_type}",
-                "task": content
-            }
+        return await self.handle_task(message.get("content", {}))
     
     async def handle_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """Handle a task assigned to this agent."""
         task_type = task.get("type", "")
+        handler = self._handlers.get(task_type)
         
-        if task_type == "architecture_question":
-            return await self._handle_architecture_question(task)
-        elif task_type == "execute_step":
-            return await self._handle_execute_step(task)
-        elif task_type == "design_system":
-            return await self._handle_design_system(task)
-        else:
-            return {
-                "status": "error",
-                "message": f"Unsupported task type: {task_type}",
-                "task": task
-            }
+        if handler:
+            return await handler(task)
+        
+        return {
+            "status": "error",
+            "message": f"Unsupported task type: {task_type}",
+            "task": task
+        }
     
     async def _handle_execute_step(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a step in a plan."""
@@ -55,139 +206,60 @@ class ArchitectAgent(BaseAgent):
         project_title = context.get("title", "Unknown project")
         project_description = context.get("description", "No description provided")
         
+        # Nothing to ask the AI about for a placeholder step
+        if not step_description and project_title == "Unknown project":
+            return self._fallback_step_response(step_id, step_title, project_title)
+        
         # Create a prompt based on the step and context
         if "analyze requirements" in step_title.lower():
-            prompt = f"""
-            You are an expert software architect. Please analyze the requirements for the following project:
-            
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a comprehensive list of functional and non-functional requirements for this project.
-            Also include a high-level architecture with key components.
-            
-            Format your response as JSON with the following structure:
-            {{
-                "requirements": [
-                    "Detailed requirement 1 specific to {project_title}",
-                    "Detailed requirement 2 specific to {project_title}",
-                    "..."
-                ],
-                "architecture": {{
-                    "components": [
-                        {{"name": "Component name specific to {project_title}", "description": "Detailed description of this component's purpose and functionality"}},
-                        {{...}}
-                    ],
-                    "data_flow": "Detailed description of how data flows between components"
-                }}
-            }}
-            """
+            template_id = TemplateId.ARCHITECT_ANALYZE_REQUIREMENTS
+            system = _ANALYZE_REQUIREMENTS_SYSTEM
+            prompt = _PROJECT_USER_TPL.format(project_title=project_title, project_description=project_description)
+            schema = ArchitectureResponse
         elif "design solution" in step_title.lower():
-            prompt = f"""
-            You are an expert software architect. Please design a solution for the following project:
-            
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a detailed design including UI mockup description, components, and data model.
-            
-            Format your response as JSON with the following structure:
-            {{
-                "design": {{
-                    "ui_mockup": "Detailed description of the user interface for {project_title}",
-                    "components": [
-                        {{"name": "Component name specific to {project_title}", "purpose": "Detailed description of this component's purpose"}},
-                        {{...}}
-                    ],
-                    "data_model": {{
-                        "Entity1": "data type and description",
-                        "Entity2": "data type and description",
-                        "...": "..."
-                    }}
-                }}
-            }}
-            """
+            template_id = TemplateId.ARCHITECT_DESIGN_SOLUTION
+            system = _DESIGN_SOLUTION_SYSTEM
+            prompt = _PROJECT_USER_TPL.format(project_title=project_title, project_description=project_description)
+            schema = DesignResponse
         else:
-            prompt = f"""
-            You are an expert software architect. Please complete the following step in a software development plan:
-            
-            Step: {step_title}
-            Description: {step_description}
-            
-            Context:
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a detailed response appropriate for this step in the development process.
-            
-            Format your response as JSON with appropriate fields for this step.
-            """
+            template_id = TemplateId.ARCHITECT_EXECUTE_STEP
+            system = _EXECUTE_STEP_SYSTEM
+            prompt = _EXECUTE_STEP_USER_TPL.format(step_title=step_title, step_description=step_description, project_title=project_title, project_description=project_description)
+            schema = None
+        
+        # Reuse a response generated for the same step of a project with the same description
+        cached = self.generative_cache.get(template_id, step_title, step_description, project_title, project_description)
+        if cached is not None:
+            return {
+                "status": "success",
+                "message": f"Completed step {step_id} (cached)",
+                "result": cached
+            }
+        
+        # Simpler prompts used if the first attempt fails or stalls
+        retry_prompt = _EXECUTE_STEP_RETRY_TPL.format(project_title=project_title, project_description=project_description, step_title=step_title)
+        
+        final_attempt_prompt = _EXECUTE_STEP_FINAL_TPL.format(project_title=project_title, step_title=step_title, project_description=project_description)
         
         try:
-            # Call the AI to generate a response with a low temperature for more focused output
-            ai_response = await self.generate_json_response(prompt, temperature=0.2)
+            # Call the AI with a low temperature for more focused output, hedging with the simpler prompts
+            winner, responses = await self._with_hedged_retries([
+                {"prompt": prompt, "temperature": 0.2, "schema": schema, "system": system},
+                {"prompt": retry_prompt, "temperature": 0.3},
+                {"prompt": final_attempt_prompt, "temperature": 0.1}
+            ])
             
-            # If successful, return the AI-generated response
-            if ai_response["status"] == "success":
+            # If successful, cache and return the AI-generated response
+            if winner >= 0:
+                self.generative_cache.put(template_id, step_title, step_description, project_title, project_description, responses[winner]["data"])
                 return {
                     "status": "success",
                     "message": f"Completed step {step_id}",
-                    "result": ai_response["data"]
+                    "result": responses[winner]["data"]
                 }
             else:
-                # If AI fails, make another attempt with a simpler prompt
-                retry_prompt = f"""
-                Generate a detailed response for this software development step:
-                Project: {project_title}
-                Description: {project_description}
-                Step: {step_title}
-                
-                For this specific project, include relevant features and components.
-                
-                Your response must be in JSON format and specifically tailored to {project_title}.
-                If this is a requirements analysis step, include "requirements" and "architecture" fields.
-                If this is a design step, include a "design" field with "ui_mockup", "components", and "data_model".
-                """
-                
-                retry_response = await self.generate_json_response(retry_prompt, temperature=0.3)
-                
-                if retry_response["status"] == "success":
-                    return {
-                        "status": "success",
-                        "message": f"Completed step {step_id}",
-                        "result": retry_response["data"]
-                    }
-                else:
-                    # If both attempts fail, try one more time with an even simpler prompt
-                    final_attempt_prompt = f"""
-                    Create a JSON response for {project_title} with appropriate fields based on the step: {step_title}.
-                    Make sure your response is specifically about {project_description}.
-                    """
-                    
-                    final_response = await self.generate_json_response(final_attempt_prompt, temperature=0.1)
-                    
-                    if final_response["status"] == "success":
-                        return {
-                            "status": "success",
-                            "message": f"Completed step {step_id}",
-                            "result": final_response["data"]
-                        }
-                    else:
-                        # If all attempts fail, return a minimal dynamic response
-                        return {
-                            "status": "success",
-                            "message": f"Completed step {step_id} with minimal response",
-                            "result": {
-                                "output": f"Analysis completed for {project_title}: {step_title}",
-                                "next_steps": f"Continue with implementation of {project_title}"
-                            }
-                        }
+                # If all attempts fail, return a minimal dynamic response
+                return self._fallback_step_response(step_id, step_title, project_title)
         except Exception as e:
             # Handle any exceptions that might occur during processing
             return {
@@ -199,7 +271,42 @@ class ArchitectAgent(BaseAgent):
                     "error": str(e)
                 }
             }
-
+    
+    def _fallback_step_response(self, step_id: str, step_title: str, project_title: str) -> Dict[str, Any]:
+        """Build the minimal response used when a step cannot be generated by the AI."""
+        return {
+            "status": "success",
+            "message": f"Completed step {step_id} with minimal response",
+            "result": {
+                "output": f"Analysis completed for {project_title}: {step_title}",
+                "next_steps": f"Continue with implementation of {project_title}"
+            }
+        }
+    
+    async def _handle_execute_steps_batch(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """Execute several independent steps of a plan concurrently."""
+        steps = task.get("steps", [])
+        context = task.get("context", {})
+        
+        if not steps:
+            return {
+                "status": "error",
+                "message": "No steps provided for batch execution"
+            }
+        
+        semaphore = asyncio.Semaphore(LLM_MAX_CONC)
+        
+        async def execute(step: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._handle_execute_step({"type": "execute_step", "step": step, "context": context})
+        
+        results = await asyncio.gather(*(execute(step) for step in steps))
+        
+        return {
+            "status": "success",
+            "message": f"Executed {len(results)} steps",
+            "results": list(results)
+        }
 
     async def _handle_architecture_question(self, content: Dict[str, Any]) -> Dict[str, Any]:
         """Handle an architecture question using AI."""
@@ -212,71 +319,41 @@ class ArchitectAgent(BaseAgent):
             }
         
         # Create a prompt for the AI
-        prompt = f"""
-        You are an expert software architect. Please provide a detailed architecture recommendation for the following question:
-        
-        Question: {question}
+        prompt = _ARCHITECTURE_QUESTION_USER_TPL.format(question=question)
         
-        Your response should include:
-        1. Overall architecture style recommendation
-        2. Key components and their responsibilities
-        3. Recommended patterns and practices
-        4. Suitable technologies
-        5. Considerations for scalability, security, and maintainability
-        
-        Format your response as JSON with the following structure:
-        {{
-            "architecture_type": "string",
-            "components": [
-                {{"name": "string", "purpose": "string"}}
-            ],
-            "patterns": ["string"],
-            "technologies": ["string"],
-            "considerations": ["string"]
-        }}
-        """
+        # Simpler prompt used if the first attempt fails or stalls
+        retry_prompt = _ARCHITECTURE_QUESTION_RETRY_TPL.format(question=question)
         
         try:
-            # Call the AI to generate a response
-            ai_response = await self.generate_json_response(prompt)
+            # Call the AI to generate a response, hedging with the simpler prompt
+            winner, responses = await self._with_hedged_retries([
+                {"prompt": prompt, "temperature": 0.7, "schema": ArchitectureRecommendation, "system": _ARCHITECTURE_QUESTION_SYSTEM},
+                {"prompt": retry_prompt, "temperature": 0.3}
+            ])
             
-            if ai_response["status"] == "success":
+            if winner >= 0:
                 return {
                     "status": "success",
-                    "message": "Architecture recommendation provided by AI",
-                    "architecture": ai_response["data"]
+                    "message": "Architecture recommendation provided by AI" + (" (retry)" if winner > 0 else ""),
+                    "architecture": responses[winner]["data"]
                 }
             else:
-                # Log the error for debugging
-                print(f"First attempt failed: {ai_response['message']}")
+                ai_response = responses[0]
+                retry_response = responses[1] or ai_response
                 
-                # If the first attempt fails, try with a simpler prompt
-                retry_prompt = f"""
-                Provide an architecture recommendation for: {question}
-                Format as JSON with architecture_type, components, patterns, technologies, and considerations fields.
-                """
-                
-                retry_response = await self.generate_json_response(retry_prompt, temperature=0.3)
+                # Log the errors for debugging
+                print(f"First attempt failed: {ai_response['message']}")
+                print(f"Second attempt failed: {retry_response['message']}")
                 
-                if retry_response["status"] == "success":
-                    return {
-                        "status": "success",
-                        "message": "Architecture recommendation provided by AI (retry)",
-                        "architecture": retry_response["data"]
-                    }
-                else:
-                    # Log the error for debugging
-                    print(f"Second attempt failed: {retry_response['message']}")
-                    
-                    # Return an error response instead of a hardcoded fallback
-                    return {
-                        "status": "error",
-                        "message": "Failed to generate architecture recommendation",
-                        "details": {
-                            "first_attempt_error": ai_response.get("message", "Unknown error"),
-                            "retry_attempt_error": retry_response.get("message", "Unknown error")
-                        }
+                # Return an error response instead of a hardcoded fallback
+                return {
+                    "status": "error",
+                    "message": "Failed to generate architecture recommendation",
+                    "details": {
+                        "first_attempt_error": ai_response.get("message", "Unknown error"),
+                        "retry_attempt_error": retry_response.get("message", "Unknown error")
                     }
+                }
         except Exception as e:
             # Catch any unexpected exceptions
             print(f"Unexpected error in _handle_architecture_question: {str(e)}")
@@ -290,62 +367,24 @@ class ArchitectAgent(BaseAgent):
         system_name = task.get("system_name", "")
         requirements = task.get("requirements", [])
         
-        # Create a prompt based on the system name and requirements
-        prompt = f"""
-        You are an expert software architect. Please design a system with the following details:
-        
-        System Name: {system_name}
-        Requirements: {', '.join(requirements)}
-        
-        Your design should include:
-        1. Overall architecture style
-        2. Key components and their responsibilities
-        3. Technology stack recommendations
-        4. Deployment strategy
-        
-        Format your response as JSON with the following structure:
-        {{
-            "system_name": "{system_name}",
-            "architecture_style": "string",
-            "components": [
-                {{"name": "string", "technology": "string", "responsibility": "string"}}
-            ],
-            "deployment": {{
-                "strategy": "string",
-                "platform": "string",
-                "ci_cd": "string"
-            }}
-        }}
+        # Create a prompt based on the system name and requirements, plus a simpler fallback
+        prompt = _DESIGN_SYSTEM_USER_TPL.format(system_name=system_name, requirements=', '.join(requirements))
+        retry_prompt = _DESIGN_SYSTEM_RETRY_TPL.format(system_name=system_name, requirements=', '.join(requirements))
         
-        Ensure that your design is specifically tailored to {system_name} and addresses the provided requirements.
-        """
+        # Call the AI, starting the simpler prompt if the first one fails or gets no response within 3 seconds
+        winner, responses = await self._with_hedged_retries([
+            {"prompt": prompt, "temperature": 0.2, "schema": SystemDesignResponse, "system": _DESIGN_SYSTEM_SYSTEM},
+            {"prompt": retry_prompt, "temperature": 0.3}
+        ], hedge_after=3.0)
         
-        # Call the AI to generate a response
-        ai_response = await self.generate_json_response(prompt, temperature=0.2)
-        
-        if ai_response["status"] == "success":
+        if winner >= 0:
             return {
                 "status": "success",
-                "message": f"Design created for {system_name}",
-                "design": ai_response["data"]
+                "message": f"Design created for {system_name}" + (" (retry)" if winner > 0 else ""),
+                "design": responses[winner]["data"]
             }
         else:
-            # If the first attempt fails, try with a simpler prompt
-            retry_prompt = f"""
-            Design a system for {system_name} that addresses these requirements: {', '.join(requirements)}
-            Format as JSON with system_name, architecture_style, components, and deployment fields.
-            """
-            
-            retry_response = await self.generate_json_response(retry_prompt, temperature=0.3)
-            
-            if retry_response["status"] == "success":
-                return {
-                    "status": "success",
-                    "message": f"Design created for {system_name} (retry)",
-                    "design": retry_response["data"]
-                }
-            else:
-                return {
-                    "status": "error",
-                    "message": f"Failed to generate design for {system_name}"
-                }
+            return {
+                "status": "error",
+                "message": f"Failed to generate design for {system_name}"
+            }
\ No newline at end of file
@@ -1,23 +1,154 @@
 import json
 import os
 import uuid
-import aiohttp  # Add this import for HTTP requests
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Type
 import abc
-import sys
-import os
-
-# Add the project root to the path to enable absolute imports
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import re
+import functools
+import hashlib
+import asyncio
+import contextvars
+import time
+from jiter import from_json
+from pydantic import BaseModel, ValidationError
 from utils.ai_integration import AIIntegration
+from utils.llm_cache import cached_llm_call
+from utils.generative_cache import GenerativeCache
+
+# Maximum number of concurrent AI calls made for a batch
+LLM_MAX_CONC = int(os.getenv("LLM_MAX_CONC", "8"))
+
+# Matches a markdown code block, optionally tagged as json. The closing fence may be
+# missing when a streamed response was cut off after the JSON object.
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+@functools.lru_cache(maxsize=1024)
+def _extract_fenced_json(content: str) -> str:
+    """Get the contents of the first markdown code block, or the whole text if there is none."""
+    match = _FENCE_RE.search(content)
+    return match.group(1).strip() if match else content
+
+# Number of streamed characters between checks for a complete JSON object
+_STREAM_CHECK_INTERVAL = 512
+_JSON_DECODER = json.JSONDecoder()
+
+def _is_complete_json(content: str) -> bool:
+    """Check whether the response's top-level JSON object or array has been fully received.
+    
+    The value must start the response, or the first markdown code block, so braces in
+    prose or the first element of an array don't end the stream early.
+    """
+    start = len(content) - len(content.lstrip())
+    if content.startswith("```", start):
+        newline = content.find("\n", start)
+        if newline < 0:
+            return False
+        start = newline + 1
+        while start < len(content) and content[start].isspace():
+            start += 1
+    
+    if start >= len(content) or content[start] not in "{[":
+        return False
+    try:
+        _JSON_DECODER.raw_decode(content, start)
+        return True
+    except ValueError:
+        return False
+
+# Set by hedged attempts to learn when their response starts streaming
+_first_chunk: contextvars.ContextVar[Optional[asyncio.Event]] = contextvars.ContextVar("_first_chunk", default=None)
+
+# One AIIntegration for the whole process so every agent shares its connection pool
+_AI_SINGLETON: Optional[AIIntegration] = None
+
+def _get_ai() -> AIIntegration:
+    """Get the shared AIIntegration, creating it on first use."""
+    global _AI_SINGLETON
+    _AI_SINGLETON = _AI_SINGLETON or AIIntegration()
+    return _AI_SINGLETON
+
+def _parse_and_validate(content: str, schema: Type[BaseModel] = None) -> Dict[str, Any]:
+    """Parse AI content as JSON, validating it against the schema if one is given."""
+    # Parse and validate against the schema in one pass
+    if schema is not None:
+        try:
+            try:
+                model = schema.model_validate_json(content)
+            except ValidationError:
+                try:
+                    model = schema.model_validate_json(_extract_fenced_json(content))
+                except ValidationError:
+                    # The JSON may be surrounded by other text, e.g. a preface from the model
+                    data = AIIntegration.extract_json_from_text(content)
+                    if "raw_text" in data:
+                        raise
+                    model = schema.model_validate(data)
+            
+            return {
+                "status": "success",
+                "message": "Successfully generated JSON response",
+                "data": model.model_dump()
+            }
+        except ValidationError as e:
+            return {
+                "status": "error",
+                "message": f"Response does not match {schema.__name__}: {str(e)}",
+                "raw_content": content
+            }
+    
+    # Try to parse the content as JSON
+    try:
+        try:
+            # Parse bare JSON in a single pass. Truncated output must fail so it is retried.
+            data = from_json(content.encode(), allow_inf_nan=False)
+        except ValueError:
+            # Parse the JSON content (it might be wrapped in markdown code blocks)
+            data = json.loads(_extract_fenced_json(content))
+        
+        return {
+            "status": "success",
+            "message": "Successfully generated JSON response",
+            "data": data
+        }
+    except json.JSONDecodeError as e:
+        # If JSON parsing fails, try to extract JSON using a more robust method
+        try:
+            data = AIIntegration.extract_json_from_text(content)
+            if "raw_text" not in data:
+                return {
+                    "status": "success",
+                    "message": "Successfully extracted JSON response",
+                    "data": data
+                }
+            else:
+                return {
+                    "status": "error",
+                    "message": f"Failed to parse JSON response: {str(e)}",
+                    "raw_content": content
+                }
+        except Exception as json_ex:
+            return {
+                "status": "error",
+                "message": f"Failed to parse JSON response: {str(e)}, extraction error: {str(json_ex)}",
+                "raw_content": content
+            }
 
 class BaseAgent(abc.ABC):
     """Base class for all agents in the system."""
     
+    # Shared by all agents so steps repeated across projects are served without an API call
+    generative_cache = GenerativeCache()
+    
+    # Consecutive overload errors (429/503) that open the circuit, and how long it stays open
+    CIRCUIT_BREAKER_THRESHOLD = 3
+    CIRCUIT_BREAKER_COOLDOWN = 30.0
+    
     def __init__(self, agent_id: str = None, name: str = "BaseAgent"):
-        self.agent_id = agent_id or str(uuid.uuid4())
+        self.agent_id = agent_id or uuid.uuid4().hex
         self.name = name
-        self.ai = AIIntegration()
+        self.ai = _get_ai()
+        self._overload_failures = 0
+        self._circuit_open_until = 0.0
     
     def get_agent_info(self) -> Dict[str, Any]:
         """Get basic information about this agent."""
@@ -37,15 +168,54 @@ class BaseAgent(abc.ABC):
         content = message.get("content", {})
         return await self.handle_task(content)
     
-    async def generate_ai_response(self, prompt: str, temperature: float = 0.7) -> Dict[str, Any]:
+    async def generate_ai_response(self, prompt: str, temperature: float = 0.7, system: str = None) -> Dict[str, Any]:
         """Generate a response using AI."""
-        return await self.ai.generate_content(prompt, temperature)
+        return await self.ai.generate_content(prompt, temperature, system)
     
-    async def generate_json_response(self, prompt: str, temperature: float = 0.7) -> Dict[str, Any]:
-        """Generate a JSON response from the AI."""
+    async def _generate_streamed_content(self, prompt: str, temperature: float = 0.7, system: str = None) -> Dict[str, Any]:
+        """Stream AI content, stopping as soon as the complete top-level JSON value has arrived."""
+        chunks = []
+        received = 0
+        checked = 0
+        stream = self.ai.generate_content_stream(prompt, temperature, system)
+        
         try:
-            # Use the existing AIIntegration class
-            ai_response = await self.ai.generate_content(prompt, temperature)
+            async for event in stream:
+                if event["status"] != "success":
+                    return event
+                
+                if not chunks and _first_chunk.get() is not None:
+                    _first_chunk.get().set()
+                chunks.append(event["content"])
+                received += len(event["content"])
+                
+                # Periodically check whether the top-level JSON value is complete
+                if received - checked >= _STREAM_CHECK_INTERVAL:
+                    checked = received
+                    if _is_complete_json("".join(chunks)):
+                        break
+        finally:
+            await stream.aclose()
+        
+        return {"status": "success", "content": "".join(chunks)}
+    
+    @cached_llm_call
+    async def generate_json_response(self, prompt: str, temperature: float = 0.7, schema: Type[BaseModel] = None, system: str = None) -> Dict[str, Any]:
+        """Generate a JSON response from the AI, reusing cached responses for repeated low-temperature prompts.
+        
+        If a schema is given, the response must validate against it. A static `system`
+        prompt is sent ahead of the variable `prompt` so providers can cache the prefix.
+        """
+        # Don't call the provider while it is overloaded
+        if time.monotonic() < self._circuit_open_until:
+            return {
+                "status": "error",
+                "message": "AI provider is overloaded, skipping call until cooldown ends"
+            }
+        
+        try:
+            ai_response = await self._generate_streamed_content(prompt, temperature, system)
+            self._record_ai_result(ai_response)
             
             if ai_response["status"] != "success":
                 return {
@@ -56,47 +226,107 @@ class BaseAgent(abc.ABC):
             
             content = ai_response.get("content", "")
             
-            # Try to parse the content as JSON
-            try:
-                # Find JSON content within the response (it might be wrapped in markdown code blocks)
-                json_content = content
-                if "```json" in content:
-                    json_content = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    json_content = content.split("```")[1].split("```")[0].strip()
-                
-                # Parse the JSON content
-                data = json.loads(json_content)
-                
-                return {
-                    "status": "success",
-                    "message": "Successfully generated JSON response",
-                    "data": data
-                }
-            except json.JSONDecodeError as e:
-                # If JSON parsing fails, try to extract JSON using a more robust method
-                try:
-                    data = self.ai.extract_json_from_text(content)
-                    if "raw_text" not in data:
-                        return {
-                            "status": "success",
-                            "message": "Successfully extracted JSON response",
-                            "data": data
-                        }
-                    else:
-                        return {
-                            "status": "error",
-                            "message": f"Failed to parse JSON response: {str(e)}",
-                            "raw_content": content
-                        }
-                except Exception as json_ex:
-                    return {
-                        "status": "error",
-                        "message": f"Failed to parse JSON response: {str(e)}, extraction error: {str(json_ex)}",
-                        "raw_content": content
-                    }
+            # Parse off the event loop so concurrent calls keep making progress
+            return await asyncio.to_thread(_parse_and_validate, content, schema)
         except Exception as e:
             return {
                 "status": "error",
                 "message": f"Error generating response: {str(e)}"
-            }
\ No newline at end of file
+            }
+    
+    def _record_ai_result(self, ai_response: Dict[str, Any]) -> None:
+        """Track overload errors and open the circuit after too many in a row."""
+        if ai_response.get("status_code") in (429, 503):
+            self._overload_failures += 1
+            if self._overload_failures >= self.CIRCUIT_BREAKER_THRESHOLD:
+                self._circuit_open_until = time.monotonic() + self.CIRCUIT_BREAKER_COOLDOWN
+                self._overload_failures = 0
+        else:
+            self._overload_failures = 0
+    
+    async def generate_json_batch(self, prompts: List[str], temperature: float = 0.7) -> List[Dict[str, Any]]:
+        """Generate JSON responses for several prompts concurrently."""
+        semaphore = asyncio.Semaphore(LLM_MAX_CONC)
+        
+        async def generate(prompt: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generate_json_response(prompt, temperature)
+        
+        return list(await asyncio.gather(*(generate(prompt) for prompt in prompts)))
+    
+    async def _hedged_attempt(self, started: asyncio.Event, attempt: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one hedged attempt, setting `started` once its response starts streaming."""
+        _first_chunk.set(started)
+        return await self.generate_json_response(**attempt)
+    
+    async def _with_hedged_retries(self, prompts: List[Dict[str, Any]], hedge_after: float = 4.0) -> Tuple[int, List[Optional[Dict[str, Any]]]]:
+        """Race JSON attempts, each given as generate_json_response keyword arguments.
+        
+        The next attempt is started as soon as the running ones have failed, or if the
+        latest one hasn't started streaming its response within `hedge_after` seconds.
+        An attempt that is streaming is left to finish rather than raced, since long
+        responses take a while to arrive. Attempts repeating an earlier prompt are
+        skipped. Returns the index of the first successful attempt (-1 if none succeeded)
+        and the responses per attempt (None if skipped or unfinished).
+        """
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        attempts: Dict[asyncio.Task, int] = {}
+        pending = set()
+        started_waiter: Optional[asyncio.Task] = None
+        loop = asyncio.get_running_loop()
+        
+        # Drop attempts that would send the same request again
+        seen = set()
+        unique_prompts = []
+        for index, attempt in enumerate(prompts):
+            digest = hashlib.blake2b((attempt.get("system") or "").encode() + attempt["prompt"].encode()).digest()[:8]
+            if digest not in seen:
+                seen.add(digest)
+                unique_prompts.append((index, attempt))
+        
+        try:
+            for position, (index, attempt) in enumerate(unique_prompts):
+                started = asyncio.Event()
+                task = asyncio.create_task(self._hedged_attempt(started, attempt))
+                attempts[task] = index
+                pending.add(task)
+                
+                # The last attempt waits for everything still running; earlier ones hedge
+                # until their response starts streaming
+                deadline = None
+                if position < len(unique_prompts) - 1:
+                    deadline = loop.time() + hedge_after
+                    started_waiter = asyncio.create_task(started.wait())
+                
+                while pending:
+                    if started.is_set():
+                        deadline = None
+                    timeout = None if deadline is None else deadline - loop.time()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    
+                    waiting = pending | {started_waiter} if deadline is not None else pending
+                    done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    done.discard(started_waiter)
+                    pending -= done
+                    for finished in done:
+                        try:
+                            response = finished.result()
+                        except Exception as e:
+                            response = {"status": "error", "message": f"Error generating response: {str(e)}"}
+                        
+                        responses[attempts[finished]] = response
+                        if response.get("status") == "success":
+                            return attempts[finished], responses
+                
+                if started_waiter is not None:
+                    started_waiter.cancel()
+                    started_waiter = None
+            
+            return -1, responses
+        finally:
+            # Cancel attempts that lost the race
+            for task in pending:
+                task.cancel()
+            if started_waiter is not None:
+                started_waiter.cancel()
@@ -1,12 +1,115 @@
-from typing import Dict, Any, List
-import json
+from typing import Dict, Any
+import re
 from .base_agent import BaseAgent
+from schemas.responses import ImplementationResponse
+from utils.generative_cache import TemplateId
+
+# Matches a markdown code block with an optional language tag. The closing fence may be
+# missing when the response was cut off.
+_CODE_RE = re.compile(r"```(?:(\w+)\r?\n)?(.*?)(?:```|$)", re.DOTALL)
+
+# Static system prompts come first and variable user prompts last, so repeated calls
+# share a prefix the provider can cache. User prompt templates are filled in with str.format.
+_WRITE_CODE_SYSTEM = """
+Write code in the language given by the user that meets the user's requirements.
+
+Provide only the code without explanations. Make sure the code is well-documented with comments.
+"""
+
+_WRITE_CODE_USER_TPL = """
+Language: {language}
+
+Requirements:
+{requirements}
+"""
+
+_IMPLEMENT_SOLUTION_SYSTEM = """
+You are an expert software developer. Please implement a solution for the project given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to that project.
+
+Provide a detailed implementation including code, explanations, and usage instructions.
+
+Format your response as JSON with the following structure:
+{
+    "explanation": "Detailed explanation of the implementation approach for the project",
+    "implementation": "The actual code implementation for the project",
+    "usage_instructions": "Instructions on how to use or deploy the implementation"
+}
+"""
+
+_TEST_SOLUTION_SYSTEM = """
+You are an expert software tester. Please create tests for the project given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to that project.
+
+Provide a detailed test plan including test cases, test code, and instructions for running the tests.
+
+Format your response as JSON with the following structure:
+{
+    "explanation": "Detailed explanation of the testing approach for the project",
+    "implementation": "The actual test code for the project",
+    "usage_instructions": "Instructions on how to run the tests"
+}
+"""
+
+_PROJECT_USER_TPL = """
+Project: {project_title}
+Description: {project_description}
+"""
+
+_EXECUTE_STEP_SYSTEM = """
+You are an expert software developer. Please complete the step in a software development plan given by the user.
+
+CRITICAL INSTRUCTION: Your response MUST be specifically tailored to the user's project.
+
+Provide a detailed response appropriate for this step in the development process.
+
+Format your response as JSON with the following structure:
+{
+    "explanation": "Detailed explanation of what you're implementing for the project",
+    "implementation": "The actual code or implementation details",
+    "usage_instructions": "Instructions on how to use or test the implementation"
+}
+"""
+
+_EXECUTE_STEP_USER_TPL = """
+Step: {step_title}
+Description: {step_description}
+
+Context:
+Project: {project_title}
+Description: {project_description}
+"""
+
+_EXECUTE_STEP_RETRY_TPL = """
+Generate code for this software development step:
+Project: {project_title}
+Description: {project_description}
+Step: {step_title}
+
+For this specific project, include relevant features and components.
+
+Your response must be in JSON format with these fields:
+- explanation: Brief explanation of what you're implementing
+- implementation: The actual code
+- usage_instructions: How to use the code
+"""
+
+_EXECUTE_STEP_FINAL_TPL = """
+Create a JSON response for {project_title} with explanation, implementation, and usage_instructions fields.
+Make sure your response is specifically about {project_description}.
+"""
 
 class CoderAgent(BaseAgent):
     """Agent responsible for writing and reviewing code."""
     
     def __init__(self, agent_id: str = None, name: str = "CoderAgent"):
         super().__init__(agent_id, name)
+        self._handlers = {
+            "execute_step": self._handle_execute_step,
+            "write_code": self._handle_write_code
+        }
     
     async def process_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """Process a message sent to this agent."""
@@ -15,33 +118,15 @@ class CoderAgent(BaseAgent):
     async def handle_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """Handle a task assigned to this agent."""
         task_type = task.get("type", "")
+        handler = self._handlers.get(task_type)
         
-        if task_type == "execute_step":
-            return await self._handle_execute_step(task)
-        elif task_type == "write_code":
-            return await self._handle_write_code(task)
-        else:
-            return {
-                "status": "error",
-                "message": f"Unsupported task type: {task_type}",
-                "task": task
-            }
-    
-    async def _handle_execute_step(self, task: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle executing a step in a plan."""
-        step = task.get("step", {})
-        step_id = step.get("id", "unknown")
-        step_title = step.get("title", "unknown")
+        if handler:
+            return await handler(task)
         
-        # For now, just return a minimal response
         return {
-            "status": "success",
-            "message": f"Completed step {step_id} (fallback)",
-            "result": {
-                "explanation": f"Implemented solution for {step_title}",
-                "implementation": "// Implementation code would go here",
-                "usage_instructions": "Instructions for using the implementation"
-            }
+            "status": "error",
+            "message": f"Unsupported task type: {task_type}",
+            "task": task
         }
     
     async def _handle_write_code(self, task: Dict[str, Any]) -> Dict[str, Any]:
@@ -56,27 +141,18 @@ class CoderAgent(BaseAgent):
             }
         
         # Create a prompt for the AI
-        prompt = f"""
-        Write {language} code that meets the following requirements:
-        
-        {requirements}
-        
-        Provide only the code without explanations. Make sure the code is well-documented with comments.
-        """
+        prompt = _WRITE_CODE_USER_TPL.format(language=language, requirements=requirements)
         
         # Call the AI to generate the code
-        ai_response = await self.generate_ai_response(prompt, temperature=0.2)
+        ai_response = await self.generate_ai_response(prompt, temperature=0.2, system=_WRITE_CODE_SYSTEM)
         
         if ai_response.get("status") == "success":
             code = ai_response.get("content", "# No code generated")
             
             # Clean up the code (remove markdown code blocks if present)
-            if "```" in code:
-                code_parts = code.split("```")
-                for part in code_parts:
-                    if language in part or part.strip().startswith("def ") or part.strip().startswith("class "):
-                        code = part.replace(f"{language}\n", "").strip()
-                        break
+            match = _CODE_RE.search(code)
+            if match:
+                code = match.group(2).strip()
             
             return {
                 "status": "success",
@@ -106,123 +182,65 @@ class CoderAgent(BaseAgent):
         project_title = context.get("title", "Unknown project")
         project_description = context.get("description", "No description provided")
         
+        # Nothing to ask the AI about for a placeholder step
+        if not step_description and project_title == "Unknown project":
+            return self._fallback_step_response(step_id, step_title)
+        
         # Create a prompt based on the step and context
         if "implement solution" in step_title.lower():
-            prompt = f"""
-            You are an expert software developer. Please implement a solution for the following project:
-            
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a detailed implementation including code, explanations, and usage instructions.
-            
-            Format your response as JSON with the following structure:
-            {{
-                "explanation": "Detailed explanation of the implementation approach for {project_title}",
-                "implementation": "The actual code implementation for {project_title}",
-                "usage_instructions": "Instructions on how to use or deploy the implementation"
-            }}
-            """
+            template_id = TemplateId.CODER_IMPLEMENT_SOLUTION
+            system = _IMPLEMENT_SOLUTION_SYSTEM
+            prompt = _PROJECT_USER_TPL.format(project_title=project_title, project_description=project_description)
         elif "test solution" in step_title.lower():
-            prompt = f"""
-            You are an expert software tester. Please create tests for the following project:
-            
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a detailed test plan including test cases, test code, and instructions for running the tests.
-            
-            Format your response as JSON with the following structure:
-            {{
-                "explanation": "Detailed explanation of the testing approach for {project_title}",
-                "implementation": "The actual test code for {project_title}",
-                "usage_instructions": "Instructions on how to run the tests"
-            }}
-            """
+            template_id = TemplateId.CODER_TEST_SOLUTION
+            system = _TEST_SOLUTION_SYSTEM
+            prompt = _PROJECT_USER_TPL.format(project_title=project_title, project_description=project_description)
         else:
-            prompt = f"""
-            You are an expert software developer. Please complete the following step in a software development plan:
-            
-            Step: {step_title}
-            Description: {step_description}
-            
-            Context:
-            Project: {project_title}
-            Description: {project_description}
-            
-            CRITICAL INSTRUCTION: Your response MUST be specifically tailored to {project_title}.
-            
-            Provide a detailed response appropriate for this step in the development process.
-            
-            Format your response as JSON with the following structure:
-            {{
-                "explanation": "Detailed explanation of what you're implementing for {project_title}",
-                "implementation": "The actual code or implementation details",
-                "usage_instructions": "Instructions on how to use or test the implementation"
-            }}
-            """
+            template_id = TemplateId.CODER_EXECUTE_STEP
+            system = _EXECUTE_STEP_SYSTEM
+            prompt = _EXECUTE_STEP_USER_TPL.format(step_title=step_title, step_description=step_description, project_title=project_title, project_description=project_description)
+        
+        # Reuse a response generated for the same step of a project with the same description
+        cached = self.generative_cache.get(template_id, step_title, step_description, project_title, project_description)
+        if cached is not None:
+            return {
+                "status": "success",
+                "message": f"Completed step {step_id} (cached)",
+                "result": cached
+            }
+        
+        # Simpler prompts used if the first attempt fails or stalls
+        retry_prompt = _EXECUTE_STEP_RETRY_TPL.format(project_title=project_title, project_description=project_description, step_title=step_title)
+        
+        final_attempt_prompt = _EXECUTE_STEP_FINAL_TPL.format(project_title=project_title, project_description=project_description)
         
-        # Call the AI to generate a response
-        ai_response = await self.generate_json_response(prompt, temperature=0.2)
+        # Call the AI to generate a response, hedging with the simpler prompts
+        winner, responses = await self._with_hedged_retries([
+            {"prompt": prompt, "temperature": 0.2, "schema": ImplementationResponse, "system": system},
+            {"prompt": retry_prompt, "temperature": 0.3},
+            {"prompt": final_attempt_prompt, "temperature": 0.1}
+        ])
         
-        # If successful, return the AI-generated response
-        if ai_response["status"] == "success":
+        # If successful, cache and return the AI-generated response
+        if winner >= 0:
+            self.generative_cache.put(template_id, step_title, step_description, project_title, project_description, responses[winner]["data"])
             return {
                 "status": "success",
                 "message": f"Completed step {step_id}",
-                "result": ai_response["data"]
+                "result": responses[winner]["data"]
             }
         else:
-            # If AI fails, make another attempt with a simpler prompt
-            retry_prompt = f"""
-            Generate code for this software development step:
-            Project: {project_title}
-            Description: {project_description}
-            Step: {step_title}
-            
-            For this specific project, include relevant features and components.
-            
-            Your response must be in JSON format with these fields:
-            - explanation: Brief explanation of what you're implementing
-            - implementation: The actual code
-            - usage_instructions: How to use the code
-            """
-            
-            retry_response = await self.generate_json_response(retry_prompt, temperature=0.3)
-            
-            if retry_response["status"] == "success":
-                return {
-                    "status": "success",
-                    "message": f"Completed step {step_id}",
-                    "result": retry_response["data"]
-                }
-            else:
-                # If both attempts fail, try one more time with an even simpler prompt
-                final_attempt_prompt = f"""
-                Create a JSON response for {project_title} with explanation, implementation, and usage_instructions fields.
-                Make sure your response is specifically about {project_description}.
-                """
-                
-                final_response = await self.generate_json_response(final_attempt_prompt, temperature=0.1)
-                
-                if final_response["status"] == "success":
-                    return {
-                        "status": "success",
-                        "message": f"Completed step {step_id}",
-                        "result": final_response["data"]
-                    }
-                else:
-                    # If all attempts fail, return a minimal dynamic response
-                    return {
-                        "status": "success",
-                        "message": f"Completed step {step_id} (fallback)",
-                        "result": {
-                            "explanation": f"Implemented solution for {step_title}",
-                            "implementation": "// Implementation code would go here",
-                            "usage_instructions": "Instructions for using the implementation"
-                        }
-                    }
\ No newline at end of file
+            # If all attempts fail, return a minimal dynamic response
+            return self._fallback_step_response(step_id, step_title)
+    
+    def _fallback_step_response(self, step_id: str, step_title: str) -> Dict[str, Any]:
+        """Build the minimal response used when a step cannot be generated by the AI."""
+        return {
+            "status": "success",
+            "message": f"Completed step {step_id} (fallback)",
+            "result": {
+                "explanation": f"Implemented solution for {step_title}",
+                "implementation": "// Implementation code would go here",
+                "usage_instructions": "Instructions for using the implementation"
+            }
+        }
\ No newline at end of file
@@ -1,12 +1,33 @@
-from typing import Dict, Any, List, Optional
+import asyncio
+from typing import Dict, Any
 from .base_agent import BaseAgent
 
 class MemoryAgent(BaseAgent):
     """Agent responsible for storing and retrieving memory."""
     
+    # Storage methods that save each memory type, by name since storage can be swapped
+    _SAVERS = {
+        "task": "save_task",
+        "message": "save_message",
+        "agent": "register_agent"
+    }
+    
+    # Storage methods that list all entries or get one entry by ID
+    _GETTERS = {
+        "task": ("get_all_tasks_with_plans", "get_task_with_plan"),
+        "agent": ("get_all_agents", "get_agent")
+    }
+    
     def __init__(self, agent_id: str = None, name: str = "MemoryAgent", storage=None):
         super().__init__(agent_id, name)
         self.storage = storage
+        self._handlers = {
+            "store": self._store_memory,
+            "retrieve": self._retrieve_memory,
+            "update": self._update_memory,
+            "delete": self._delete_memory,
+            "search": self._search_memory
+        }
     
     def set_storage(self, storage):
         """Set the storage backend for this agent."""
@@ -32,17 +53,10 @@ class MemoryAgent(BaseAgent):
             }
         
         task_type = task.get("type", "")
+        handler = self._handlers.get(task_type)
         
-        if task_type == "store":
-            return await self._store_memory(task)
-        elif task_type == "retrieve":
-            return await self._retrieve_memory(task)
-        elif task_type == "update":
-            return await self._update_memory(task)
-        elif task_type == "delete":
-            return await self._delete_memory(task)
-        elif task_type == "search":
-            return await self._search_memory(task)
+        if handler:
+            return await handler(task)
         
         return {
             "status": "error",
@@ -61,13 +75,11 @@ class MemoryAgent(BaseAgent):
                 "message": "Missing memory_type or data for storage"
             }
         
+        # Storage does blocking I/O, so run it in a worker thread
         try:
-            if memory_type == "task":
-                memory_id = self.storage.save_task(data)
-            elif memory_type == "message":
-                memory_id = self.storage.save_message(data)
-            elif memory_type == "agent":
-                memory_id = self.storage.register_agent(data)
+            saver = self._SAVERS.get(memory_type)
+            if saver:
+                memory_id = await asyncio.to_thread(getattr(self.storage, saver), data)
             elif memory_type == "context":
                 key = task.get("key", "")
                 if not key:
@@ -75,7 +87,7 @@ class MemoryAgent(BaseAgent):
                         "status": "error",
                         "message": "Missing key for context storage"
                     }
-                self.storage.save_context(key, data)
+                await asyncio.to_thread(self.storage.save_context, key, data)
                 memory_id = key
             else:
                 return {
@@ -106,22 +118,22 @@ class MemoryAgent(BaseAgent):
             }
         
         try:
-            if memory_type == "task":
+            getters = self._GETTERS.get(memory_type)
+            if getters:
+                get_all, get_one = getters
                 if not memory_id:
-                    data = self.storage.get_all_tasks()
+                    data = await asyncio.to_thread(getattr(self.storage, get_all))
                 else:
-                    data = self.storage.get_task(memory_id)
+                    data = await asyncio.to_thread(getattr(self.storage, get_one), memory_id)
             elif memory_type == "message":
-                filter_dict = task.get("filter", {})
-                data = self.storage.get_messages(filter_dict)
-            elif memory_type == "agent":
-                if not memory_id:
-                    data = self.storage.get_all_agents()
+                if memory_id:
+                    data = await asyncio.to_thread(self.storage.get_message, memory_id)
                 else:
-                    data = self.storage.get_agent(memory_id)
+                    filter_dict = task.get("filter", {})
+                    data = await asyncio.to_thread(self.storage.get_messages, filter_dict)
             elif memory_type == "context":
                 key = task.get("key", None)
-                data = self.storage.get_context(key)
+                data = await asyncio.to_thread(self.storage.get_context, key)
             else:
                 return {
                     "status": "error",
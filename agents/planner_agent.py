@@ -1,10 +1,115 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+import os
+import re
 import json
+import time
+import copy
+import asyncio
+import hashlib
 from .base_agent import BaseAgent
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PLAN_CACHE_DIR = os.path.join(os.getenv("MEMORY_STORAGE_PATH", "memory_data"), "plan_cache")
+PLAN_CACHE_TTL = 7 * 24 * 60 * 60
+PLAN_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# Words too generic to show whether a plan is about the goal
+_COMMON_WORDS = frozenset({"a", "an", "the", "and", "or", "but", "for", "with", "about", "create", "build", "develop", "implement"})
+_WORD_RE = re.compile(r"[A-Za-z]{4,}")
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Static system prompts come first and variable user prompts last, so repeated calls
+# share a prefix the provider can cache. User prompt templates are filled in with str.format.
+_PLAN_GOAL_SYSTEM = """
+You are an expert project planner. Please create a detailed plan for the goal given by the user.
+
+IMPORTANT: Your plan must be specifically tailored to that exact goal. Do not create a generic plan or a plan for a different project.
+
+For example, if the goal is about a weather app, create a plan specifically for a weather app, not for a calculator or any other application.
+
+Your plan should include:
+1. A clear title that reflects the exact goal
+2. A series of steps with:
+   - Step ID
+   - Title
+   - Description (specific to the goal)
+   - Assigned role (architect_agent, coder_agent, etc.)
+   - Dependencies (which steps must be completed first)
+
+Format your response as JSON with the following structure:
+{
+    "title": "Plan for: <goal>",
+    "steps": [
+        {
+            "id": "step_1",
+            "title": "string",
+            "description": "string",
+            "assigned_to": "string",
+            "depends_on": ["string"] // Optional
+        }
+    ]
+}
+"""
+
+_PLAN_GOAL_USER_TPL = """
+Goal: {goal}
+
+Ensure that each step is directly relevant to building {goal_root}.
+"""
+
+_RETRY_PLAN_SYSTEM = """
+You are an expert project planner. You MUST create a plan SPECIFICALLY for the goal given by the user.
+
+CRITICAL: Your plan must be about that goal and nothing else.
+
+Format your response as JSON with the following structure:
+{
+    "title": "Plan for: <goal>",
+    "steps": [
+        {
+            "id": "step_1",
+            "title": "string",
+            "description": "string",
+            "assigned_to": "string",
+            "depends_on": ["string"] // Optional
+        }
+    ]
+}
+"""
+
+_RETRY_PLAN_USER_TPL = """
+Goal: {goal}
+
+Your plan should include:
+1. A title that explicitly mentions {goal_root}
+2. Steps that are directly related to building {goal_root}
+"""
+
+def _normalize_goal(goal: str) -> str:
+    """Normalize a goal so trivially different spellings share a plan cache entry."""
+    return _WHITESPACE_RE.sub(" ", _PUNCTUATION_RE.sub("", goal.lower())).strip()
+
+def _is_valid_plan(plan: Dict[str, Any]) -> bool:
+    """Check that a plan has a title and steps with an id and assignee."""
+    if not isinstance(plan, dict) or not isinstance(plan.get("title"), str):
+        return False
+    steps = plan.get("steps")
+    if not isinstance(steps, list) or not steps:
+        return False
+    return all(isinstance(step, dict) and step.get("id") and step.get("assigned_to") for step in steps)
+
 class PlannerAgent(BaseAgent):
     """Agent responsible for breaking down tasks into actionable steps."""
     
+    # Plans being generated, by goal fingerprint, so identical concurrent goals share one AI call
+    _inflight: Dict[str, asyncio.Future] = {}
+    
     def __init__(self, agent_id: str = None, name: str = "PlannerAgent"):
         super().__init__(agent_id, name)
     
@@ -49,44 +154,53 @@ class PlannerAgent(BaseAgent):
                 "message": "No goal provided for planning"
             }
         
+        # Reuse the plan for a goal we have already planned
+        fingerprint = hashlib.sha256(_normalize_goal(goal).encode()).hexdigest()
+        cached_plan = self._plan_cache_get(fingerprint)
+        if cached_plan is not None:
+            return {
+                "status": "success",
+                "message": "Goal successfully planned by AI (cached)",
+                "plan": cached_plan
+            }
+        
+        # Wait for a plan already being generated for the same goal
+        while (inflight := self._inflight.get(fingerprint)) is not None:
+            try:
+                # Copy it since the caller updates the plan's steps as they run
+                return copy.deepcopy(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                # Plan the goal here if the caller generating it was cancelled, rather than us
+                if not inflight.cancelled():
+                    raise
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[fingerprint] = future
+        try:
+            result = await self._plan_goal_with_ai(goal, fingerprint)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+            raise
+        except BaseException:
+            # Don't pass cancellation on to unrelated callers; they fall back to planning themselves
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[fingerprint]
+        
+        future.set_result(result)
+        return result
+    
+    async def _plan_goal_with_ai(self, goal: str, fingerprint: str) -> Dict[str, Any]:
+        """Generate a plan for a goal with AI and cache it."""
         # Create a prompt for the AI with clear instructions to focus on the specific goal
-        prompt = f"""
-        You are an expert project planner. Please create a detailed plan for the following goal:
-        
-        Goal: {goal}
-        
-        IMPORTANT: Your plan must be specifically tailored to this exact goal. Do not create a generic plan or a plan for a different project.
-        
-        For example, if the goal is about a weather app, create a plan specifically for a weather app, not for a calculator or any other application.
-        
-        Your plan should include:
-        1. A clear title that reflects the exact goal
-        2. A series of steps with:
-           - Step ID
-           - Title
-           - Description (specific to the goal)
-           - Assigned role (architect_agent, coder_agent, etc.)
-           - Dependencies (which steps must be completed first)
-        
-        Format your response as JSON with the following structure:
-        {{
-            "title": "Plan for: {goal}",
-            "steps": [
-                {{
-                    "id": "step_1",
-                    "title": "string",
-                    "description": "string",
-                    "assigned_to": "string",
-                    "depends_on": ["string"] // Optional
-                }}
-            ]
-        }}
-        
-        Ensure that each step is directly relevant to building {goal.split(':')[0] if ':' in goal else goal}.
-        """
+        goal_root = goal.split(':', 1)[0].strip() if ':' in goal else goal
+        prompt = _PLAN_GOAL_USER_TPL.format(goal=goal, goal_root=goal_root)
         
         # Call the AI to generate a response
-        ai_response = await self.generate_json_response(prompt, temperature=0.2)  # Lower temperature for more focused output
+        ai_response = await self.generate_json_response(prompt, temperature=0.2, system=_PLAN_GOAL_SYSTEM)  # Lower temperature for more focused output
         
         if ai_response["status"] == "success":
             # Validate that the plan is relevant to the goal
@@ -99,6 +213,7 @@ class PlannerAgent(BaseAgent):
             is_relevant = any(keyword in plan_title for keyword in goal_keywords)
             
             if is_relevant:
+                self._plan_cache_put(fingerprint, plan_data)
                 return {
                     "status": "success",
                     "message": "Goal successfully planned by AI",
@@ -106,42 +221,21 @@ class PlannerAgent(BaseAgent):
                 }
             else:
                 # If the plan doesn't seem relevant, try again with more explicit instructions
-                return await self._retry_plan_generation(goal)
+                return await self._retry_plan_generation(goal, fingerprint)
         else:
             # Fall back to a manually created plan
             return self._create_fallback_plan(goal)
     
-    async def _retry_plan_generation(self, goal: str) -> Dict[str, Any]:
+    async def _retry_plan_generation(self, goal: str, fingerprint: str = None) -> Dict[str, Any]:
         """Retry plan generation with more explicit instructions."""
-        prompt = f"""
-        You are an expert project planner. You MUST create a plan SPECIFICALLY for this goal:
-        
-        Goal: {goal}
-        
-        CRITICAL: Your plan must be about {goal.split(':')[0] if ':' in goal else goal} and nothing else.
-        
-        Your plan should include:
-        1. A title that explicitly mentions {goal.split(':')[0] if ':' in goal else goal}
-        2. Steps that are directly related to building {goal.split(':')[0] if ':' in goal else goal}
-        
-        Format your response as JSON with the following structure:
-        {{
-            "title": "Plan for: {goal}",
-            "steps": [
-                {{
-                    "id": "step_1",
-                    "title": "string",
-                    "description": "string",
-                    "assigned_to": "string",
-                    "depends_on": ["string"] // Optional
-                }}
-            ]
-        }}
-        """
-        
-        ai_response = await self.generate_json_response(prompt, temperature=0.1)  # Even lower temperature
+        goal_root = goal.split(':', 1)[0].strip() if ':' in goal else goal
+        prompt = _RETRY_PLAN_USER_TPL.format(goal=goal, goal_root=goal_root)
+        
+        ai_response = await self.generate_json_response(prompt, temperature=0.1, system=_RETRY_PLAN_SYSTEM)  # Even lower temperature
         
         if ai_response["status"] == "success":
+            if fingerprint:
+                self._plan_cache_put(fingerprint, ai_response["data"])
             return {
                 "status": "success",
                 "message": "Goal successfully planned by AI (retry)",
@@ -150,12 +244,71 @@ class PlannerAgent(BaseAgent):
         else:
             return self._create_fallback_plan(goal)
     
+    def _plan_cache_get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Get a cached plan by goal fingerprint, dropping it if it has expired."""
+        path = os.path.join(PLAN_CACHE_DIR, f"{fingerprint}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > PLAN_CACHE_TTL:
+                os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                plan = orjson.loads(f.read()) if orjson else json.loads(f.read())
+            # Touch the file so eviction keeps recently used plans
+            os.utime(path)
+        except (ValueError, OSError):
+            return None
+        
+        return plan if _is_valid_plan(plan) else None
+    
+    def _plan_cache_put(self, fingerprint: str, plan: Dict[str, Any]) -> None:
+        """Cache a valid plan under its goal fingerprint and evict old entries."""
+        if not _is_valid_plan(plan):
+            return
+        
+        os.makedirs(PLAN_CACHE_DIR, exist_ok=True)
+        path = os.path.join(PLAN_CACHE_DIR, f"{fingerprint}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(plan, default=str) if orjson else json.dumps(plan, separators=(",", ":"), default=str).encode())
+        os.replace(tmp_path, path)
+        
+        self._plan_cache_cleanup()
+    
+    def _plan_cache_cleanup(self) -> None:
+        """Remove expired plans, then the least recently used ones while over the size cap."""
+        now = time.time()
+        entries = []
+        with os.scandir(PLAN_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime > PLAN_CACHE_TTL:
+                    self._unlink_quietly(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= PLAN_CACHE_MAX_BYTES:
+                break
+            self._unlink_quietly(path)
+            total_size -= size
+    
+    @staticmethod
+    def _unlink_quietly(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    
     def _extract_keywords(self, text: str) -> List[str]:
         """Extract key words from text for relevance checking."""
         # Remove common words and keep important keywords
-        common_words = {"a", "an", "the", "and", "or", "but", "for", "with", "about", "create", "build", "develop", "implement"}
-        words = text.split()
-        return [word for word in words if word.lower() not in common_words and len(word) > 3]
+        return [word for word in _WORD_RE.findall(text.lower()) if word not in _COMMON_WORDS]
     
     def _create_fallback_plan(self, goal: str) -> Dict[str, Any]:
         """Create a fallback plan when AI generation fails."""
@@ -1,32 +1,69 @@
+import os
+import json
+import hashlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The base agents that agents.json is reset to, serialized once at import
+_BASE_AGENTS = [
+    {
+        "agent_id": "7514baf0-599b-47ef-b6b2-c5f48031b461",
+        "name": "PlannerAgent",
+        "type": "PlannerAgent"
+    },
+    {
+        "agent_id": "ee25eaf7-58ae-4411-aa59-4367fee3d7da",
+        "name": "CoderAgent",
+        "type": "CoderAgent"
+    },
+    {
+        "agent_id": "6c720d68-dfa0-4bcc-a897-4f83cb175454",
+        "name": "MemoryAgent",
+        "type": "MemoryAgent"
+    },
+    {
+        "agent_id": "1cf32b15-2849-4d5e-ae10-c2aab6bbb59c",
+        "name": "ArchitectAgent",
+        "type": "ArchitectAgent"
+    }
+]
+
+if orjson:
+    _BASE_AGENTS_JSON = orjson.dumps(_BASE_AGENTS)
+else:
+    _BASE_AGENTS_JSON = json.dumps(_BASE_AGENTS, separators=(",", ":")).encode()
+_BASE_AGENTS_HASH = hashlib.sha256(_BASE_AGENTS_JSON).hexdigest()
+
+_AGENTS_FILE = os.path.join("memory_data", "agents.json")
+
+# Modification time of agents.json when it last held the base agents
+_agents_file_mtime = None
+
 # Add this function to clear agent cache
 async def clear_agent_cache():
     """Clear any cached context in agents to prevent contamination between projects."""
-    # Reset the agents.json file to only contain the base agents
-    base_agents = [
-        {
-            "agent_id": "7514baf0-599b-47ef-b6b2-c5f48031b461",
-            "name": "PlannerAgent",
-            "type": "PlannerAgent"
-        },
-        {
-            "agent_id": "ee25eaf7-58ae-4411-aa59-4367fee3d7da",
-            "name": "CoderAgent",
-            "type": "CoderAgent"
-        },
-        {
-            "agent_id": "6c720d68-dfa0-4bcc-a897-4f83cb175454",
-            "name": "MemoryAgent",
-            "type": "MemoryAgent"
-        },
-        {
-            "agent_id": "1cf32b15-2849-4d5e-ae10-c2aab6bbb59c",
-            "name": "ArchitectAgent",
-            "type": "ArchitectAgent"
-        }
-    ]
+    global _agents_file_mtime
+    
+    # Reset the agents.json file to only contain the base agents, unless it already does
+    try:
+        mtime = os.stat(_AGENTS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    
+    if mtime is not None and mtime != _agents_file_mtime:
+        with open(_AGENTS_FILE, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() == _BASE_AGENTS_HASH:
+                _agents_file_mtime = mtime
     
-    with open("memory_data/agents.json", "w") as f:
-        json.dump(base_agents, f, indent=2)
+    if mtime is None or mtime != _agents_file_mtime:
+        tmp_path = f"{_AGENTS_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_BASE_AGENTS_JSON)
+        os.replace(tmp_path, _AGENTS_FILE)
+        _agents_file_mtime = os.stat(_AGENTS_FILE).st_mtime_ns
     
     # You may also want to clear any other cached data
     # For example, if you have a memory store or context cache
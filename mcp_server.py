@@ -1,11 +1,15 @@
 import os
 import json
+import atexit
+import asyncio
+import re
 import uuid
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 import uvicorn
 from fastapi import FastAPI, HTTPException, Body, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # Import our components
@@ -14,13 +18,14 @@ from agents.coder_agent import CoderAgent
 from agents.memory_agent import MemoryAgent
 from agents.architect_agent import ArchitectAgent
 from memory.storage import MemoryStorage
-from schemas.message import Message, Task, MessageType, MessagePriority
+from schemas.message import Message, Task, MessageType, MessagePriority, AgentKind
 
 # Create the FastAPI app
 app = FastAPI(
     title="MCP Server",
     description="A minimal MCP server that can talk to agents, store memory, and serve user tasks",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # Initialize storage
@@ -43,15 +48,154 @@ agents = {
 for agent_id, agent in agents.items():
     storage.register_agent(agent.get_agent_info())
 
+# Agents indexed by AgentKind, and the recipient names that route to each kind
+_AGENTS = (planner_agent, coder_agent, memory_agent, architect_agent)
+_AGENT_NAMES = ("planner", "coder", "memory", "architect")
+_ROUTE = {name: AgentKind(i) for i, name in enumerate(_AGENT_NAMES)}
+
+# Plan steps are assigned by role name, e.g. "coder_agent"
+_ASSIGNED_TO_KIND = {**_ROUTE, **{f"{name}_agent": kind for name, kind in _ROUTE.items()}}
+_ASSIGNED_RE = re.compile(r"^(%s)(?:_|$)" % "|".join(_AGENT_NAMES))
+
 # Task queue for background processing
 task_queue = []
 
+# Number of executed steps between saves of a task's progress
+STEP_SAVE_INTERVAL = int(os.getenv("STEP_SAVE_INTERVAL", "5"))
+
+# Limit on plan steps running at once across all tasks, to avoid bursts against the AI provider
+step_semaphore = asyncio.Semaphore(int(os.getenv("STEP_MAX_CONC", "4")))
+
+# Seconds the flush worker waits to coalesce further saves of the same task
+FLUSH_WINDOW = 0.1
+# Seconds the flush worker waits before retrying a failed write
+FLUSH_RETRY_DELAY = 1.0
+
+# Task and plan saves from background processing, written by a single flush worker.
+# Entries are keyed on ("task" or "plan", task ID).
+_flush_q: "asyncio.Queue[Tuple[Tuple[str, str], Dict[str, Any]]]" = asyncio.Queue()
+_flush_worker_task: Optional[asyncio.Task] = None
+# Saves taken off the queue but not yet written
+_flush_pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+@app.on_event("startup")
+async def startup():
+    """Pre-warm connections to the AI provider and start the task flush worker."""
+    asyncio.create_task(planner_agent.ai.warm_up())
+    _start_flush_worker()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Write any pending task saves and close the shared HTTP session when the server stops."""
+    if _flush_worker_task is not None:
+        _flush_worker_task.cancel()
+        await asyncio.gather(_flush_worker_task, return_exceptions=True)
+    await planner_agent.ai.close()
+
 # Helper functions
+# Storage does blocking file I/O, so run it in a worker thread to keep the event loop free
+async def _save_task(task: Dict[str, Any]) -> str:
+    return await asyncio.to_thread(storage.save_task, task)
+
+async def _get_task(task_id: str) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(storage.get_task, task_id)
+
+def _start_flush_worker() -> None:
+    global _flush_worker_task
+    if _flush_worker_task is None or _flush_worker_task.done():
+        _flush_worker_task = asyncio.create_task(_flush_worker())
+
+async def _queue_task_save(task: Dict[str, Any]) -> None:
+    """Queue a task to be saved by the flush worker."""
+    _start_flush_worker()
+    await _flush_q.put((("task", task["task_id"]), task.copy()))
+
+async def _queue_plan_save(task_id: str, plan: Dict[str, Any]) -> None:
+    """Queue a plan to be saved by the flush worker."""
+    _start_flush_worker()
+    # Copy the steps, which change while the plan runs, so the plan can be saved from another thread
+    snapshot = {**plan, "steps": [dict(step) for step in plan.get("steps", [])]}
+    await _flush_q.put((("plan", task_id), snapshot))
+
+def _write_queued(pending: Dict[Tuple[str, str], Dict[str, Any]]) -> None:
+    for (kind, task_id), data in pending.items():
+        if kind == "plan":
+            storage.save_plan(task_id, data)
+    tasks = [data for (kind, _), data in pending.items() if kind == "task"]
+    if tasks:
+        storage.save_tasks_bulk(tasks)
+
+def _drain_flush_q() -> None:
+    while not _flush_q.empty():
+        key, data = _flush_q.get_nowait()
+        _flush_pending[key] = data
+
+def flush_pending_saves() -> None:
+    """Write all queued task and plan saves now."""
+    _drain_flush_q()
+    batch = dict(_flush_pending)
+    _flush_pending.clear()
+    _write_queued(batch)
+
+# Write queued saves even if the server exits without running its shutdown hook
+atexit.register(flush_pending_saves)
+
+async def _flush_worker() -> None:
+    """Save queued tasks and plans, keeping only the latest update of each within each window."""
+    write: Optional[asyncio.Future] = None
+    try:
+        while True:
+            # Saves from a failed write are still pending and are retried without waiting for more
+            if not _flush_pending:
+                key, data = await _flush_q.get()
+                _flush_pending[key] = data
+            
+            # Let further saves arrive, then take everything queued so far
+            await asyncio.sleep(FLUSH_WINDOW)
+            _drain_flush_q()
+            batch = dict(_flush_pending)
+            
+            # Shielded so a stopped worker can wait for the write to finish
+            write = asyncio.ensure_future(asyncio.to_thread(_write_queued, batch))
+            try:
+                await asyncio.shield(write)
+            except Exception as e:
+                print(f"Error saving queued tasks and plans, retrying: {str(e)}")
+                await asyncio.sleep(FLUSH_RETRY_DELAY)
+                continue
+            
+            # Keep saves that were queued again while the batch was being written
+            for key, data in batch.items():
+                if _flush_pending.get(key) is data:
+                    del _flush_pending[key]
+    finally:
+        # Let an interrupted write finish so it can't overwrite the newer saves written next
+        if write is not None and not write.done():
+            await asyncio.gather(write, return_exceptions=True)
+        # Don't lose updates when the worker is stopped
+        flush_pending_saves()
+
+def _build_task(goal: Dict[str, Any], default_creator: str = "user", default_priority: str = "medium") -> Dict[str, Any]:
+    """Create a pending task for the MCP from a goal."""
+    now = datetime.now().isoformat()
+    return {
+        "task_id": uuid.uuid4().hex,
+        "title": goal.get("title"),
+        "description": goal.get("description"),
+        "assigned_to": "mcp",
+        "created_by": goal.get("created_by", default_creator),
+        "status": "pending",
+        "priority": goal.get("priority", default_priority),
+        "created_at": now,
+        "updated_at": now
+    }
+
 async def process_message(message: Dict[str, Any]) -> Dict[str, Any]:
     """Process a message by routing it to the appropriate agent."""
     recipient = message.get("recipient", "")
+    kind = _ROUTE.get(recipient)
     
-    if recipient not in agents:
+    if kind is None:
         return {
             "status": "error",
             "message": f"Unknown recipient: {recipient}",
@@ -59,14 +203,14 @@ async def process_message(message: Dict[str, Any]) -> Dict[str, Any]:
         }
     
     # Store the message
-    storage.save_message(message)
+    await storage.asave_message(message)
     
     # Process the message with the appropriate agent
-    response = await agents[recipient].process_message(message)
+    response = await _AGENTS[kind].process_message(message)
     
     # Create a response message
     response_message = {
-        "message_id": str(uuid.uuid4()),
+        "message_id": uuid.uuid4().hex,
         "timestamp": datetime.now().isoformat(),
         "sender": recipient,
         "recipient": message.get("sender", "user"),
@@ -77,15 +221,52 @@ async def process_message(message: Dict[str, Any]) -> Dict[str, Any]:
     }
     
     # Store the response
-    storage.save_message(response_message)
+    await storage.asave_message(response_message)
     
     return response_message
 
+# Fields that are the same on every step message
+_STEP_MESSAGE_BASE = {
+    "sender": "mcp",
+    "message_type": "task",
+    "priority": "medium"
+}
+
+async def execute_step(step: Dict[str, Any], context: Dict[str, Any]) -> None:
+    """Send a plan step to its agent and record the outcome on the step."""
+    # Assign the step to the appropriate agent
+    assigned_to = step.get("assigned_to", "")
+    kind = _ASSIGNED_TO_KIND.get(assigned_to)
+    if kind is None:
+        # Fall back to the agent type prefix, defaulting to architect if unknown
+        match = _ASSIGNED_RE.match(assigned_to)
+        kind = _ROUTE[match.group(1)] if match else AgentKind.ARCHITECT
+    
+    step_message = {
+        **_STEP_MESSAGE_BASE,
+        "message_id": uuid.uuid4().hex,
+        "timestamp": datetime.now().isoformat(),
+        "recipient": _AGENT_NAMES[kind],
+        "content": {
+            "type": "execute_step",
+            "step": step,
+            "task_id": context["task_id"],
+            "context": context
+        }
+    }
+    
+    async with step_semaphore:
+        step_response = await process_message(step_message)
+    
+    # Update the step status
+    step["status"] = "completed" if step_response.get("content", {}).get("status") == "success" else "failed"
+    step["result"] = step_response.get("content", {})
+
 async def process_task_in_background(task: Dict[str, Any]) -> None:
     """Process a task in the background."""
     # First, plan the task
     plan_message = {
-        "message_id": str(uuid.uuid4()),
+        "message_id": uuid.uuid4().hex,
         "timestamp": datetime.now().isoformat(),
         "sender": "mcp",
         "recipient": "planner",
@@ -100,81 +281,73 @@ async def process_task_in_background(task: Dict[str, Any]) -> None:
     plan_response = await process_message(plan_message)
     plan = plan_response.get("content", {}).get("plan", {})
     
-    # Create a copy of the task to avoid circular references
-    task_update = task.copy()
-    task_update["plan"] = plan
+    # Hold the task in memory while its steps run and only queue saves at checkpoints.
+    # The plan is saved on its own so step updates don't rewrite the task.
+    task_id = task.get("task_id")
+    task_update = await _get_task(task_id) or task.copy()
+    task_update.pop("plan", None)
+    task_update["plan_ref"] = task_id
     task_update["status"] = "planned"
-    storage.save_task(task_update)
+    await _queue_plan_save(task_id, plan)
+    await _queue_task_save(task_update)
     
-    # Process each step in the plan
+    # Order the steps so each runs after the steps it depends on. Steps are keyed by
+    # position since AI plans may leave out or repeat step ids.
     steps = plan.get("steps", [])
-    for step in steps:
-        # Check dependencies
-        dependencies = step.get("depends_on", [])
-        all_dependencies_met = True
-        
-        for dep_id in dependencies:
-            # Find the dependency step
-            dep_step = next((s for s in steps if s.get("id") == dep_id), None)
-            if not dep_step or dep_step.get("status") != "completed":
-                all_dependencies_met = False
-                break
-        
-        if not all_dependencies_met:
-            continue
-        
-        # Assign the step to the appropriate agent
-        assigned_to = step.get("assigned_to", "").split("_")[0]  # Extract agent type from "agent_name"
-        if assigned_to not in agents:
-            # Default to architect if unknown
-            assigned_to = "architect"
-        
-        step_message = {
-            "message_id": str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "sender": "mcp",
-            "recipient": assigned_to,
-            "message_type": "task",
-            "priority": "medium",
-            "content": {
-                "type": "execute_step",
-                "step": step,
-                "task_id": task.get("task_id"),
-                # Create a simplified context to avoid circular references
-                "context": {
-                    "task_id": task.get("task_id"),
-                    "title": task.get("title"),
-                    "description": task.get("description")
-                }
-            }
-        }
-        
-        step_response = await process_message(step_message)
+    indices_by_id = {}
+    for index, step in enumerate(steps):
+        if step.get("id") is not None:
+            indices_by_id.setdefault(step["id"], []).append(index)
+    
+    indegree = [0] * len(steps)
+    children = [[] for _ in steps]
+    for index, step in enumerate(steps):
+        for dep_id in step.get("depends_on", []) or []:
+            # Steps with unknown dependencies can never have them met
+            parents = indices_by_id.get(dep_id)
+            if parents is None:
+                indegree[index] += 1
+                continue
+            for parent in parents:
+                indegree[index] += 1
+                children[parent].append(index)
+    
+    ready = [index for index in range(len(steps)) if indegree[index] == 0]
+    
+    # Create a simplified context, shared by all steps, to avoid circular references
+    context = {
+        "task_id": task_id,
+        "title": task.get("title"),
+        "description": task.get("description")
+    }
+    
+    # Run each frontier of independent steps concurrently
+    completed_since_save = 0
+    while ready:
+        batch, ready = ready, []
+        await asyncio.gather(*(execute_step(steps[index], context) for index in batch))
         
-        # Update the step status
-        step["status"] = "completed" if step_response.get("content", {}).get("status") == "success" else "failed"
-        step["result"] = step_response.get("content", {})
+        # Only steps that completed unblock their dependents
+        for index in batch:
+            if steps[index]["status"] == "completed":
+                for child in children[index]:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        ready.append(child)
         
-        # Create a new copy of the task for each update
-        task_update = storage.get_task(task.get("task_id"))
-        if task_update:
-            # Update the step in the plan
-            for i, s in enumerate(task_update.get("plan", {}).get("steps", [])):
-                if s.get("id") == step.get("id"):
-                    task_update["plan"]["steps"][i] = step
-            
-            task_update["updated_at"] = datetime.now().isoformat()
-            storage.save_task(task_update)
+        # Persist progress every few steps rather than after each one
+        completed_since_save += len(batch)
+        if completed_since_save >= STEP_SAVE_INTERVAL:
+            completed_since_save = 0
+            await _queue_plan_save(task_id, plan)
     
     # Check if all steps are completed
     all_completed = all(step.get("status") == "completed" for step in steps)
     
     # Final update to the task
-    task_update = storage.get_task(task.get("task_id"))
-    if task_update:
-        task_update["status"] = "completed" if all_completed else "partially_completed"
-        task_update["updated_at"] = datetime.now().isoformat()
-        storage.save_task(task_update)
+    task_update["status"] = "completed" if all_completed else "partially_completed"
+    await _queue_plan_save(task_id, plan)
+    await _queue_task_save(task_update)
 
 # API routes
 @app.get("/")
@@ -199,20 +372,10 @@ async def create_goal(
         raise HTTPException(status_code=400, detail="Goal must include title and description")
     
     # Create a task from the goal
-    task = {
-        "task_id": str(uuid.uuid4()),
-        "title": goal.get("title"),
-        "description": goal.get("description"),
-        "assigned_to": "mcp",
-        "created_by": goal.get("created_by", "user"),
-        "status": "pending",
-        "priority": goal.get("priority", "medium"),
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    task = _build_task(goal)
     
     # Save the task
-    task_id = storage.save_task(task)
+    task_id = await _save_task(task)
     
     # Process the task in the background
     background_tasks.add_task(process_task_in_background, task)
@@ -226,7 +389,7 @@ async def create_goal(
 @app.get("/goals/{task_id}")
 async def get_goal(task_id: str):
     """Get the status and details of a goal."""
-    task = storage.get_task(task_id)
+    task = await asyncio.to_thread(storage.get_task_with_plan, task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail=f"Goal with ID {task_id} not found")
@@ -236,7 +399,7 @@ async def get_goal(task_id: str):
 @app.get("/goals")
 async def list_goals():
     """List all goals."""
-    return storage.get_all_tasks()
+    return await asyncio.to_thread(storage.get_all_tasks_with_plans)
 
 @app.post("/messages")
 async def send_message(message: Dict[str, Any] = Body(...)):
@@ -249,7 +412,7 @@ async def send_message(message: Dict[str, Any] = Body(...)):
     
     # Add message ID and timestamp if not present
     if "message_id" not in message:
-        message["message_id"] = str(uuid.uuid4())
+        message["message_id"] = uuid.uuid4().hex
     
     if "timestamp" not in message:
         message["timestamp"] = datetime.now().isoformat()
@@ -277,17 +440,17 @@ async def list_messages(
     if message_type:
         filter_dict["message_type"] = message_type
     
-    return storage.get_messages(filter_dict)
+    return await asyncio.to_thread(storage.get_messages, filter_dict)
 
 @app.get("/agents")
 async def list_agents():
     """List all registered agents."""
-    return storage.get_all_agents()
+    return await asyncio.to_thread(storage.get_all_agents)
 
 @app.get("/agents/{agent_id}")
 async def get_agent(agent_id: str):
     """Get information about a specific agent."""
-    agent = storage.get_agent(agent_id)
+    agent = await asyncio.to_thread(storage.get_agent, agent_id)
     
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agent with ID {agent_id} not found")
@@ -306,20 +469,10 @@ async def self_improve(background_tasks: BackgroundTasks):
     }
     
     # Create a task from the goal
-    task = {
-        "task_id": str(uuid.uuid4()),
-        "title": goal.get("title"),
-        "description": goal.get("description"),
-        "assigned_to": "mcp",
-        "created_by": goal.get("created_by", "mcp"),
-        "status": "pending",
-        "priority": goal.get("priority", "high"),
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    task = _build_task(goal, default_creator="mcp", default_priority="high")
     
     # Save the task
-    task_id = storage.save_task(task)
+    task_id = await _save_task(task)
     
     # Process the task in the background
     background_tasks.add_task(process_task_in_background, task)
@@ -1,175 +1,395 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
+import asyncio
+import sqlite3
+import functools
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import uuid
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _synchronized(method):
+    """Serialize calls to a storage method, which may come from worker threads."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _dumps(data: Any) -> str:
+    """Serialize data to JSON text for a database column."""
+    if orjson:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+def _loads(text: str) -> Any:
+    """Deserialize JSON text from a database column."""
+    return orjson.loads(text) if orjson else json.loads(text)
+
+# SQLite 3.45+ can store JSON as the pre-parsed JSONB format, which json_extract
+# reads without re-parsing; otherwise payloads are stored as JSON text
+_HAS_JSONB = sqlite3.sqlite_version_info >= (3, 45, 0)
+_JSON_IN = "jsonb(?)" if _HAS_JSONB else "?"
+
+def _json_out(column: str) -> str:
+    """SQL expression reading a JSON payload column back as text."""
+    return f"json({column})" if _HAS_JSONB else column
+
+# Message fields stored in their own indexed columns for filtering
+_INDEXED_MESSAGE_FIELDS = ("sender", "recipient", "message_type")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    data NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS plans (
+    task_id TEXT PRIMARY KEY,
+    data NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    sender TEXT,
+    recipient TEXT,
+    message_type TEXT,
+    timestamp TEXT,
+    data NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender);
+CREATE INDEX IF NOT EXISTS idx_messages_recipient ON messages (recipient);
+CREATE INDEX IF NOT EXISTS idx_messages_message_type ON messages (message_type);
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id TEXT PRIMARY KEY,
+    data NOT NULL
+);
+CREATE TABLE IF NOT EXISTS context (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+);
+"""
+
 class MemoryStorage:
-    """Simple JSON-based storage for MCP memory."""
+    """SQLite-based storage for MCP memory."""
     
     def __init__(self, storage_dir: str = "memory_data"):
         self.storage_dir = storage_dir
+        self._lock = threading.RLock()
         os.makedirs(storage_dir, exist_ok=True)
         
-        # Initialize storage files
-        self.tasks_file = os.path.join(storage_dir, "tasks.json")
-        self.messages_file = os.path.join(storage_dir, "messages.json")
-        self.agents_file = os.path.join(storage_dir, "agents.json")
-        self.context_file = os.path.join(storage_dir, "context.json")
-        
-        # Create files if they don't exist
-        for file_path in [self.tasks_file, self.messages_file, self.agents_file, self.context_file]:
-            if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    json.dump([], f)
-    
-    def _read_json(self, file_path: str) -> List[Dict[str, Any]]:
-        """Read JSON data from a file."""
-        try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+        self.db_path = os.path.join(storage_dir, "memory.db")
+        is_new = not os.path.exists(self.db_path)
+        
+        # Calls are serialized by the lock, so the connection can be shared across threads
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # Gather index statistics, sampled to keep opening cheap, so filters on several
+        # message fields start from the most selective index
+        self._conn.execute("PRAGMA analysis_limit=400")
+        self._conn.execute("ANALYZE")
+        
+        # Write-through caches of rows as stored JSON text. Each read decodes a fresh
+        # copy, so callers can't change cached data and get what the database would
+        # return. The *_loaded flags mark caches that hold every row, so listing them
+        # doesn't need the database.
+        self._task_cache: Dict[str, str] = {}
+        self._agent_cache: Dict[str, str] = {}
+        self._context_cache: Dict[str, str] = {}
+        self._tasks_loaded = self._agents_loaded = self._context_loaded = False
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        
+        if is_new:
+            self._import_json_files()
     
-    def _write_json(self, file_path: str, data: List[Dict[str, Any]]) -> None:
-        """Write JSON data to a file."""
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+    def _check_external_writes(self) -> None:
+        """Drop the caches if another connection has changed the database."""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._task_cache.clear()
+            self._agent_cache.clear()
+            self._context_cache.clear()
+            self._tasks_loaded = self._agents_loaded = self._context_loaded = False
+    
+    def _import_json_files(self) -> None:
+        """Import data from the JSON files used by earlier versions of this storage."""
+        def read(name: str) -> Any:
+            try:
+                with open(os.path.join(self.storage_dir, name), 'rb') as f:
+                    return _loads(f.read())
+            except (ValueError, OSError):
+                return None
+        
+        def read_list(name: str) -> List[Dict[str, Any]]:
+            data = read(name)
+            return [item for item in data if isinstance(item, dict)] if isinstance(data, list) else []
+        
+        self.save_tasks_bulk(read_list("tasks.json"), stamp=False)
+        for message in read_list("messages.json"):
+            self.save_message(message)
+        for agent in read_list("agents.json"):
+            self.register_agent(agent)
+        
+        # Context was stored either as a plain dict or as a list of {key, value} items
+        context = read("context.json")
+        if isinstance(context, list):
+            context = {item['key']: item['value'] for item in context if isinstance(item, dict) and 'key' in item and 'value' in item}
+        for key, value in (context if isinstance(context, dict) else {}).items():
+            self.save_context(key, value)
     
     # Task operations
+    @_synchronized
     def save_task(self, task: Dict[str, Any]) -> str:
         """Save a task to storage and return its ID."""
-        tasks = self._read_json(self.tasks_file)
-        
-        # Generate ID if not present
-        if 'task_id' not in task:
-            task['task_id'] = str(uuid.uuid4())
-        
-        # Add timestamps
-        task['created_at'] = task.get('created_at', datetime.now().isoformat())
-        task['updated_at'] = datetime.now().isoformat()
+        return self.save_tasks_bulk([task])[0]
+    
+    @_synchronized
+    def save_tasks_bulk(self, tasks: List[Dict[str, Any]], stamp: bool = True) -> List[str]:
+        """Save several tasks in one transaction and return their IDs.
         
-        # Check if task already exists
-        for i, existing_task in enumerate(tasks):
-            if existing_task.get('task_id') == task['task_id']:
-                tasks[i] = task
-                self._write_json(self.tasks_file, tasks)
-                return task['task_id']
+        With `stamp` off, the tasks' own timestamps are kept as they are. A `plan` attached
+        to a task with a `plan_ref` isn't saved, since plans are saved with save_plan.
+        """
+        now = datetime.now().isoformat()
+        rows = []
+        for task in tasks:
+            # Generate ID if not present
+            if 'task_id' not in task:
+                task['task_id'] = uuid.uuid4().hex
+            
+            # Add timestamps
+            if stamp:
+                task['created_at'] = task.get('created_at', now)
+                task['updated_at'] = now
+            data = {key: value for key, value in task.items() if key != 'plan'} if 'plan_ref' in task else task
+            rows.append((task['task_id'], _dumps(data), task.get('created_at'), task.get('updated_at')))
         
-        # Add new task
-        tasks.append(task)
-        self._write_json(self.tasks_file, tasks)
-        return task['task_id']
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO tasks (task_id, data, created_at, updated_at) VALUES (?, {_JSON_IN}, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                rows
+            )
+        for task_id, data, _, _ in rows:
+            self._task_cache[task_id] = data
+        return [task['task_id'] for task in tasks]
     
+    @_synchronized
     def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
         """Get a task by ID."""
-        tasks = self._read_json(self.tasks_file)
-        for task in tasks:
-            if task.get('task_id') == task_id:
-                return task
-        return None
+        self._check_external_writes()
+        data = self._task_cache.get(task_id)
+        if data is None and not self._tasks_loaded:
+            row = self._conn.execute(f"SELECT {_json_out('data')} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row:
+                data = self._task_cache[task_id] = row[0]
+        return _loads(data) if data is not None else None
     
+    @_synchronized
     def get_all_tasks(self) -> List[Dict[str, Any]]:
         """Get all tasks."""
-        return self._read_json(self.tasks_file)
+        self._check_external_writes()
+        if not self._tasks_loaded:
+            self._task_cache = dict(self._conn.execute(f"SELECT task_id, {_json_out('data')} FROM tasks ORDER BY rowid"))
+            self._tasks_loaded = True
+        return [_loads(data) for data in self._task_cache.values()]
+    
+    # Plan operations
+    @_synchronized
+    def save_plan(self, task_id: str, plan: Dict[str, Any]) -> None:
+        """Save the plan of a task separately from the task."""
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO plans (task_id, data) VALUES (?, {_JSON_IN}) "
+                "ON CONFLICT(task_id) DO UPDATE SET data = excluded.data",
+                (task_id, _dumps(plan))
+            )
+    
+    @_synchronized
+    def get_plan(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get the plan of a task."""
+        row = self._conn.execute(f"SELECT {_json_out('data')} FROM plans WHERE task_id = ?", (task_id,)).fetchone()
+        return _loads(row[0]) if row else None
+    
+    @_synchronized
+    def get_task_with_plan(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a task by ID with its separately stored plan attached."""
+        task = self.get_task(task_id)
+        if task is not None and 'plan_ref' in task:
+            task['plan'] = self.get_plan(task['plan_ref']) or {}
+        return task
+    
+    @_synchronized
+    def get_all_tasks_with_plans(self) -> List[Dict[str, Any]]:
+        """Get all tasks with their separately stored plans attached."""
+        tasks = self.get_all_tasks()
+        plans = dict(self._conn.execute(f"SELECT task_id, {_json_out('data')} FROM plans"))
+        for task in tasks:
+            if 'plan_ref' in task:
+                data = plans.get(task['plan_ref'])
+                task['plan'] = _loads(data) if data is not None else {}
+        return tasks
     
     # Message operations
+    @_synchronized
     def save_message(self, message: Dict[str, Any]) -> str:
         """Save a message to storage and return its ID."""
-        messages = self._read_json(self.messages_file)
-        
         # Generate ID if not present
         if 'message_id' not in message:
-            message['message_id'] = str(uuid.uuid4())
+            message['message_id'] = uuid.uuid4().hex
         
         # Add timestamp if not present
         message['timestamp'] = message.get('timestamp', datetime.now().isoformat())
         
-        messages.append(message)
-        self._write_json(self.messages_file, messages)
+        columns = [value if isinstance(value, str) else None for value in (message.get(field) for field in _INDEXED_MESSAGE_FIELDS)]
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO messages (message_id, sender, recipient, message_type, timestamp, data) VALUES (?, ?, ?, ?, ?, {_JSON_IN}) "
+                "ON CONFLICT(message_id) DO UPDATE SET sender = excluded.sender, recipient = excluded.recipient, "
+                "message_type = excluded.message_type, timestamp = excluded.timestamp, data = excluded.data",
+                (message['message_id'], *columns, str(message['timestamp']), _dumps(message))
+            )
         return message['message_id']
     
+    async def asave_message(self, message: Dict[str, Any]) -> str:
+        """Save a message from async code without blocking the event loop."""
+        return await asyncio.to_thread(self.save_message, message)
+    
+    @_synchronized
+    def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Get a message by ID."""
+        row = self._conn.execute(f"SELECT {_json_out('data')} FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        return _loads(row[0]) if row else None
+    
+    @staticmethod
+    def _message_conditions(filter_dict: Optional[Dict[str, Any]]) -> Tuple[str, List[Any], Dict[str, Any]]:
+        """Split a message filter into a SQL WHERE clause, its parameters and the fields checked in Python."""
+        # Filter on the indexed columns, or on the JSON payload for other scalar values.
+        # Anything SQL can't compare exactly is checked once the messages are loaded.
+        conditions, params, remaining = [], [], {}
+        for key, value in (filter_dict or {}).items():
+            if key in _INDEXED_MESSAGE_FIELDS and isinstance(value, str):
+                conditions.append(f"{key} = ?")
+                params.append(value)
+            elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                conditions.append("json_extract(data, ?) = ?")
+                params.extend([f'$."{key}"', value])
+            else:
+                remaining[key] = value
+        
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params, remaining
+    
+    @staticmethod
+    def _matches(message: Dict[str, Any], remaining: Dict[str, Any]) -> bool:
+        return all(key in message and message[key] == value for key, value in remaining.items())
+    
+    @_synchronized
     def get_messages(self, filter_dict: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """Get messages with optional filtering."""
-        messages = self._read_json(self.messages_file)
+        where, params, remaining = self._message_conditions(filter_dict)
+        query = f"SELECT {_json_out('data')} FROM messages{where} ORDER BY rowid"
+        messages = [_loads(data) for data, in self._conn.execute(query, params)]
         
-        if not filter_dict:
+        if not remaining:
             return messages
+        return [message for message in messages if self._matches(message, remaining)]
+    
+    @_synchronized
+    def get_recent_messages(self, n: int, filter_dict: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Get the last n messages matching an optional filter, oldest first."""
+        if n <= 0:
+            return []
         
-        filtered_messages = []
-        for message in messages:
-            match = True
-            for key, value in filter_dict.items():
-                if key not in message or message[key] != value:
-                    match = False
-                    break
-            if match:
-                filtered_messages.append(message)
+        where, params, remaining = self._message_conditions(filter_dict)
+        query = f"SELECT {_json_out('data')} FROM messages{where} ORDER BY rowid DESC"
+        if not remaining:
+            query += " LIMIT ?"
+            params = [*params, n]
         
-        return filtered_messages
+        # Read newest first and stop once enough messages match
+        messages = []
+        for data, in self._conn.execute(query, params):
+            message = _loads(data)
+            if self._matches(message, remaining):
+                messages.append(message)
+                if len(messages) == n:
+                    break
+        messages.reverse()
+        return messages
     
     # Agent operations
+    @_synchronized
     def register_agent(self, agent_info: Dict[str, Any]) -> str:
         """Register an agent in the system."""
-        agents = self._read_json(self.agents_file)
-        
         # Generate ID if not present
         if 'agent_id' not in agent_info:
-            agent_info['agent_id'] = str(uuid.uuid4())
-        
-        # Check if agent already exists
-        for i, existing_agent in enumerate(agents):
-            if existing_agent.get('agent_id') == agent_info['agent_id']:
-                agents[i] = agent_info
-                self._write_json(self.agents_file, agents)
-                return agent_info['agent_id']
-        
-        # Add new agent
-        agents.append(agent_info)
-        self._write_json(self.agents_file, agents)
+            agent_info['agent_id'] = uuid.uuid4().hex
+        
+        data = _dumps(agent_info)
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO agents (agent_id, data) VALUES (?, {_JSON_IN}) "
+                "ON CONFLICT(agent_id) DO UPDATE SET data = excluded.data",
+                (agent_info['agent_id'], data)
+            )
+        self._agent_cache[agent_info['agent_id']] = data
         return agent_info['agent_id']
     
+    @_synchronized
     def get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
         """Get agent information by ID."""
-        agents = self._read_json(self.agents_file)
-        for agent in agents:
-            if agent.get('agent_id') == agent_id:
-                return agent
-        return None
+        self._check_external_writes()
+        data = self._agent_cache.get(agent_id)
+        if data is None and not self._agents_loaded:
+            row = self._conn.execute(f"SELECT {_json_out('data')} FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+            if row:
+                data = self._agent_cache[agent_id] = row[0]
+        return _loads(data) if data is not None else None
     
+    @_synchronized
     def get_all_agents(self) -> List[Dict[str, Any]]:
         """Get all registered agents."""
-        return self._read_json(self.agents_file)
+        self._check_external_writes()
+        if not self._agents_loaded:
+            self._agent_cache = dict(self._conn.execute(f"SELECT agent_id, {_json_out('data')} FROM agents ORDER BY rowid"))
+            self._agents_loaded = True
+        return [_loads(data) for data in self._agent_cache.values()]
     
     # Context operations
+    @_synchronized
     def save_context(self, key: str, value: Any) -> None:
         """Save a context value with the given key."""
-        context = self._read_json(self.context_file)
-        
-        # Convert to dict if it's a list
-        if isinstance(context, list):
-            context_dict = {}
-            for item in context:
-                if isinstance(item, dict) and 'key' in item and 'value' in item:
-                    context_dict[item['key']] = item['value']
-            context = context_dict
-        
-        context[key] = value
-        
-        # Convert back to list format for storage
-        context_list = [{'key': k, 'value': v} for k, v in context.items()]
-        self._write_json(self.context_file, context_list)
+        data = _dumps(value)
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO context (key, value) VALUES (?, {_JSON_IN}) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, data)
+            )
+        self._context_cache[key] = data
     
+    @_synchronized
     def get_context(self, key: str = None) -> Any:
         """Get a context value by key, or all context if no key provided."""
-        context_list = self._read_json(self.context_file)
-        
-        # Convert to dict
-        context = {}
-        for item in context_list:
-            if isinstance(item, dict) and 'key' in item and 'value' in item:
-                context[item['key']] = item['value']
-        
+        self._check_external_writes()
         if key:
-            return context.get(key)
-        return context
\ No newline at end of file
+            if key not in self._context_cache and not self._context_loaded:
+                row = self._conn.execute(f"SELECT {_json_out('value')} FROM context WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._context_cache[key] = row[0]
+            data = self._context_cache.get(key)
+            return _loads(data) if data is not None else None
+        
+        if not self._context_loaded:
+            self._context_cache = dict(self._conn.execute(f"SELECT key, {_json_out('value')} FROM context ORDER BY rowid"))
+            self._context_loaded = True
+        return {k: _loads(data) for k, data in self._context_cache.items()}
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Dict, Any, List, Optional
-from enum import Enum
+from enum import Enum, IntEnum
 import uuid
 from datetime import datetime
 
@@ -17,8 +17,17 @@ class MessagePriority(str, Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+class AgentKind(IntEnum):
+    PLANNER = 0
+    CODER = 1
+    MEMORY = 2
+    ARCHITECT = 3
+
+def _new_id() -> str:
+    return uuid.uuid4().hex
+
 class Message(BaseModel):
-    message_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    message_id: str = Field(default_factory=_new_id)
     timestamp: datetime = Field(default_factory=datetime.now)
     sender: str
     recipient: str
@@ -29,7 +38,7 @@ class Message(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class Task(BaseModel):
-    task_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    task_id: str = Field(default_factory=_new_id)
     title: str
     description: str
     assigned_to: str
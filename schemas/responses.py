@@ -0,0 +1,58 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, Any, List
+
+class AgentResponse(BaseModel):
+    # Keep any extra fields the AI includes beyond the requested structure
+    model_config = ConfigDict(extra="allow")
+
+class ArchitectureComponent(AgentResponse):
+    name: str
+    description: str
+
+class Architecture(AgentResponse):
+    components: List[ArchitectureComponent]
+    data_flow: str
+
+class ArchitectureResponse(AgentResponse):
+    requirements: List[str]
+    architecture: Architecture
+
+class DesignComponent(AgentResponse):
+    name: str
+    purpose: str
+
+class Design(AgentResponse):
+    ui_mockup: str
+    components: List[DesignComponent]
+    data_model: Dict[str, Any]
+
+class DesignResponse(AgentResponse):
+    design: Design
+
+class ImplementationResponse(AgentResponse):
+    explanation: str
+    implementation: str
+    usage_instructions: str
+
+class ArchitectureRecommendation(AgentResponse):
+    architecture_type: str
+    components: List[DesignComponent]
+    patterns: List[str]
+    technologies: List[str]
+    considerations: List[str]
+
+class SystemComponent(AgentResponse):
+    name: str
+    technology: str
+    responsibility: str
+
+class Deployment(AgentResponse):
+    strategy: str
+    platform: str
+    ci_cd: str
+
+class SystemDesignResponse(AgentResponse):
+    system_name: str
+    architecture_style: str
+    components: List[SystemComponent]
+    deployment: Deployment
@@ -1,74 +1,190 @@
 import os
 import json
+import asyncio
+import functools
 import aiohttp
-from typing import Dict, Any
+from urllib.parse import urlsplit
+from typing import Dict, Any, Optional, AsyncIterator
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # Load environment variables
 load_dotenv()
 
+# Added to every request to ensure the AI stays on topic
+SYSTEM_INSTRUCTION = "You are an AI assistant helping with software development tasks. Stay focused on the specific task or question provided. Respond in JSON format when requested."
+
+# Generation settings sent with every request, apart from the temperature
+_GENERATION_CONFIG = {
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 2048
+}
+
+@functools.lru_cache(maxsize=64)
+def _system_instruction(system: Optional[str] = None) -> Dict[str, Any]:
+    """Build the system instruction for a static system prompt, once per prompt."""
+    text = f"{SYSTEM_INSTRUCTION}\n\n{system}" if system else SYSTEM_INSTRUCTION
+    return {"parts": [{"text": text}]}
+
+# Shared HTTP session so every agent reuses the same connection pool
+_SESSION: Optional[aiohttp.ClientSession] = None
+
+async def get_session(max_connections: int = 200, max_keepalive: int = 50, timeout: float = 120) -> aiohttp.ClientSession:
+    """Get the shared aiohttp session, creating it on first use with the given pool settings."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=max_connections,
+                limit_per_host=max_keepalive,
+                enable_cleanup_closed=True,
+                force_close=False,
+                keepalive_timeout=75,
+                ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+    return _SESSION
+
+async def close_session() -> None:
+    """Close the shared aiohttp session."""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
 class AIIntegration:
     """Utility class for AI model integration."""
     
-    def __init__(self):
+    def __init__(self, max_connections: int = None, max_keepalive: int = None, timeout: float = None):
         # Get API key and URL from environment variables
         self.api_key = os.getenv("GEMINI_API_KEY")
         self.api_url = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent")
+        self._url = f"{self.api_url}?key={self.api_key}"
+        self._stream_url = f"{self.api_url.replace(':generateContent', ':streamGenerateContent')}?alt=sse&key={self.api_key}"
+        
+        # Connection pool settings for the shared session
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "2000"))
+        self.max_keepalive = max_keepalive or int(os.getenv("LLM_MAX_KEEPALIVE", "1500"))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
         
         if not self.api_key:
             print("Warning: GEMINI_API_KEY not found in environment variables")
     
-    async def generate_content(self, prompt: str, temperature: float = 0.7) -> Dict[str, Any]:
-        """Call the Gemini API with the given prompt."""
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared session using this integration's pool settings."""
+        return await get_session(self.max_connections, self.max_keepalive, self.timeout)
+    
+    async def close(self) -> None:
+        """Close the shared session, for use on shutdown."""
+        await close_session()
+    
+    async def warm_up(self, connections: int = 4) -> None:
+        """Open connections to the API host ahead of the first request."""
         if not self.api_key:
-            return {"status": "error", "message": "GEMINI_API_KEY not found in environment variables"}
-            
-        url = f"{self.api_url}?key={self.api_key}"
+            return
+        
+        parts = urlsplit(self.api_url)
+        base_url = f"{parts.scheme}://{parts.netloc}/"
+        session = await self._get_session()
         
-        # Add system instructions to ensure the AI stays on topic
-        system_instruction = "You are an AI assistant helping with software development tasks. Stay focused on the specific task or question provided. Respond in JSON format when requested."
+        async def head() -> None:
+            try:
+                async with session.head(base_url) as response:
+                    await response.read()
+            except Exception as e:
+                print(f"Warning: failed to pre-warm connection to {base_url}: {str(e)}")
         
-        payload = {
+        await asyncio.gather(*(head() for _ in range(connections)))
+    
+    def _build_payload(self, prompt: str, temperature: float, system: str = None) -> Dict[str, Any]:
+        """Build the Gemini request body for a prompt.
+        
+        The system instruction, and a static `system` prompt if given, are sent ahead of
+        the variable user prompt so repeated calls share a cacheable prefix.
+        """
+        return {
             "contents": [
                 {
                     "role": "user",
                     "parts": [
                         {
-                            "text": f"{system_instruction}\n\n{prompt}"
+                            "text": prompt
                         }
                     ]
                 }
             ],
-            "generationConfig": {
-                "temperature": temperature,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048
-            }
+            "generationConfig": {**_GENERATION_CONFIG, "temperature": temperature},
+            "systemInstruction": _system_instruction(system)
         }
+    
+    async def generate_content(self, prompt: str, temperature: float = 0.7, system: str = None) -> Dict[str, Any]:
+        """Call the Gemini API with the given prompt and optional static system prompt."""
+        if not self.api_key:
+            return {"status": "error", "message": "GEMINI_API_KEY not found in environment variables"}
+            
+        url = self._url
+        payload = self._build_payload(prompt, temperature, system)
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        # Extract the generated text from the response
-                        candidates = result.get("candidates", [])
-                        if candidates and len(candidates) > 0:
-                            content = candidates[0].get("content", {})
-                            parts = content.get("parts", [])
-                            if parts and len(parts) > 0:
-                                generated_text = parts[0].get("text", "")
-                                return {"status": "success", "content": generated_text}
-                        
+            session = await self._get_session()
+            async with session.post(url, json=payload) as response:
+                if response.status == 200:
+                    result = _json_loads(await response.read())
+                    # Extract the generated text from the response
+                    try:
+                        generated_text = result["candidates"][0]["content"]["parts"][0].get("text", "")
+                    except (KeyError, IndexError, TypeError, AttributeError):
                         # If we couldn't extract the text properly
                         return {"status": "error", "message": "Failed to extract content from API response", "details": result}
-                    else:
-                        error_text = await response.text()
-                        return {"status": "error", "message": f"API error: {response.status}", "details": error_text}
+                    return {"status": "success", "content": generated_text}
+                else:
+                    error_text = await response.text()
+                    return {"status": "error", "message": f"API error: {response.status}", "details": error_text, "status_code": response.status}
         except Exception as e:
             return {"status": "error", "message": f"Exception: {str(e)}"}
     
+    async def generate_content_stream(self, prompt: str, temperature: float = 0.7, system: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the Gemini response for the given prompt and optional static system prompt.
+        
+        Yields {"status": "success", "content": chunk} for each text chunk, or a single
+        error dict if the request fails. Closing the generator early cancels the request.
+        """
+        if not self.api_key:
+            yield {"status": "error", "message": "GEMINI_API_KEY not found in environment variables"}
+            return
+        
+        url = self._stream_url
+        payload = self._build_payload(prompt, temperature, system)
+        
+        try:
+            session = await self._get_session()
+            async with session.post(url, json=payload) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    yield {"status": "error", "message": f"API error: {response.status}", "details": error_text, "status_code": response.status}
+                    return
+                
+                # Each server-sent event carries a partial response
+                async for line in response.content:
+                    if not line.startswith(b"data:"):
+                        continue
+                    
+                    result = _json_loads(line[5:])
+                    candidates = result.get("candidates", [])
+                    if candidates:
+                        for part in candidates[0].get("content", {}).get("parts", []):
+                            if part.get("text"):
+                                yield {"status": "success", "content": part["text"]}
+        except Exception as e:
+            yield {"status": "error", "message": f"Exception: {str(e)}"}
+    
     @staticmethod
     def extract_json_from_text(text: str) -> Dict[str, Any]:
         """Extract JSON from text response."""
@@ -78,7 +194,7 @@ class AIIntegration:
             json_end = text.rfind("}") + 1
             if json_start >= 0 and json_end > json_start:
                 json_str = text[json_start:json_end]
-                return json.loads(json_str)
+                return _json_loads(json_str)
             else:
                 return {"raw_text": text}
         except json.JSONDecodeError:
@@ -0,0 +1,86 @@
+import re
+from enum import Enum
+from typing import Dict, Any, Optional, Tuple
+
+PROJECT_TITLE_PLACEHOLDER = "<<PROJECT_TITLE>>"
+PROJECT_DESCRIPTION_PLACEHOLDER = "<<PROJECT_DESCRIPTION>>"
+
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+class TemplateId(str, Enum):
+    ARCHITECT_ANALYZE_REQUIREMENTS = "architect_analyze_requirements"
+    ARCHITECT_DESIGN_SOLUTION = "architect_design_solution"
+    ARCHITECT_EXECUTE_STEP = "architect_execute_step"
+    CODER_IMPLEMENT_SOLUTION = "coder_implement_solution"
+    CODER_TEST_SOLUTION = "coder_test_solution"
+    CODER_EXECUTE_STEP = "coder_execute_step"
+
+def normalize(text: str) -> str:
+    """Normalize text for use in a cache key."""
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+def _whole_word_re(value: str) -> re.Pattern:
+    """Match a value only where it isn't part of a longer word."""
+    return re.compile(r"(?<!\w)" + re.escape(value) + r"(?!\w)")
+
+def _map_strings(data: Any, func) -> Any:
+    """Copy a JSON structure, applying func to every string value but not to keys."""
+    if isinstance(data, str):
+        return func(data)
+    if isinstance(data, dict):
+        return {key: _map_strings(value, func) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_map_strings(value, func) for value in data]
+    return data
+
+class GenerativeCache:
+    """Cache of step responses reusable across projects with the same description.
+
+    Responses are keyed on the prompt template, the step title and description, and the
+    normalized project description. The project title and description are replaced by
+    placeholders in the response's string values, so they can be filled in for a project
+    that differs only in its title or in the formatting of its description.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: Dict[Tuple[str, str, str, str], Any] = {}
+
+    @staticmethod
+    def _key(template_id: TemplateId, step_title: str, step_description: str, project_description: str) -> Tuple[str, str, str, str]:
+        return (template_id.value, normalize(step_title), normalize(step_description), normalize(project_description))
+
+    def get(self, template_id: TemplateId, step_title: str, step_description: str, project_title: str, project_description: str) -> Optional[Dict[str, Any]]:
+        """Get a cached response filled in for the given project."""
+        pattern = self._entries.get(self._key(template_id, step_title, step_description, project_description))
+        if pattern is None:
+            return None
+
+        def fill(text: str) -> str:
+            text = text.replace(PROJECT_TITLE_PLACEHOLDER, project_title)
+            return text.replace(PROJECT_DESCRIPTION_PLACEHOLDER, project_description)
+
+        return _map_strings(pattern, fill)
+
+    def put(self, template_id: TemplateId, step_title: str, step_description: str, project_title: str, project_description: str, response: Dict[str, Any]) -> None:
+        """Cache a response with the project details replaced by placeholders."""
+        # Replace the longer value first so a title inside the description stays intact
+        replacements = [
+            (_whole_word_re(value), placeholder)
+            for value, placeholder in sorted(
+                [(project_description, PROJECT_DESCRIPTION_PLACEHOLDER), (project_title, PROJECT_TITLE_PLACEHOLDER)],
+                key=lambda item: len(item[0]),
+                reverse=True
+            )
+            if value
+        ]
+
+        def templatize(text: str) -> str:
+            for value_re, placeholder in replacements:
+                text = value_re.sub(placeholder, text)
+            return text
+
+        key = self._key(template_id, step_title, step_description, project_description)
+        if key not in self._entries and len(self._entries) >= self.max_size:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = _map_strings(response, templatize)
@@ -0,0 +1,139 @@
+import os
+import copy
+import json
+import asyncio
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# Calls at or below this temperature are treated as deterministic
+MAX_CACHED_TEMPERATURE = 0.3
+
+# Size cap of the on-disk cache, beyond which the least recently used responses are removed
+LLM_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+class ExactPromptCache:
+    """In-memory LRU of AI responses keyed on exact prompt, backed by JSON files.
+
+    Methods do file I/O and are meant to be called from worker threads.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join(".cache", "llm"), max_size: int = 1024, max_disk_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Approximate size of the cache directory, measured on the first write
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt: str, temperature: float, system: str = None, schema: type = None) -> str:
+        """Build the cache key for a prompt, temperature, optional system prompt and response schema."""
+        schema_name = f"{schema.__module__}.{schema.__qualname__}" if schema is not None else ""
+        return hashlib.blake2b(
+            (system or "").encode() + b"\0" + prompt.encode() + b"\0" + str(temperature).encode() + b"\0" + schema_name.encode()
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of a cached response, falling back to disk on a memory miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(self._entries[key])
+
+        try:
+            with open(self._path(key), 'r') as f:
+                response = json.load(f)
+            # Touch the file so eviction keeps recently used responses
+            os.utime(self._path(key))
+        except (json.JSONDecodeError, OSError):
+            return None
+
+        with self._lock:
+            self._remember(key, response)
+        return copy.deepcopy(response)
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        """Cache a copy of a response in memory and on disk."""
+        response = copy.deepcopy(response)
+        path = self._path(key)
+        with self._lock:
+            self._remember(key, response)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                replaced_size = os.path.getsize(path)
+            except OSError:
+                replaced_size = 0
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(response, f, separators=(",", ":"), default=str)
+            os.replace(tmp_path, path)
+
+            if self._disk_bytes is None:
+                self._cleanup()
+            else:
+                self._disk_bytes += os.path.getsize(path) - replaced_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._cleanup()
+
+    def _cleanup(self) -> None:
+        """Remove the least recently used responses from disk while over the size cap."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
+        self._disk_bytes = total_size
+
+    def _remember(self, key: str, response: Dict[str, Any]) -> None:
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+_CACHE = ExactPromptCache()
+
+def cached_llm_call(func):
+    """Cache successful responses of an async `(self, prompt, temperature, schema, system)` AI call.
+
+    Only low-temperature calls are cached since their output is effectively deterministic.
+    The system prompt and response schema are part of the cache key.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, prompt: str, temperature: float = 0.7, schema: type = None, system: str = None) -> Dict[str, Any]:
+        if temperature > MAX_CACHED_TEMPERATURE:
+            return await func(self, prompt, temperature, schema, system)
+
+        # The cache reads and writes files, so use it off the event loop
+        key = ExactPromptCache.make_key(prompt, temperature, system, schema)
+        cached = await asyncio.to_thread(_CACHE.get, key)
+        if cached is not None:
+            return cached
+
+        response = await func(self, prompt, temperature, schema, system)
+        if response.get("status") == "success":
+            await asyncio.to_thread(_CACHE.put, key, response)
+        return response
+
+    return wrapper